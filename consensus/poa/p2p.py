@@ -4,11 +4,20 @@ from typing import Set, Dict, List, Tuple
 import copy
 import threading
 import socket
-from consensus.poa.blockchain_structures import Transaction, Block, Wallet, Chain, isvalidChain
-from ipfs.ipfs import addToIpfs, download_ipfs_file_subprocess
+from consensus.poa.blockchain_structures import Transaction, Block, Wallet, Chain, isvalidChain, valid_chain_length, PRUNE_DEPTH
+from ipfs.daemon import IpfsDaemon
+from ipfs.ipfs_client import IpfsClient, print_progress
+from ipfs.file_cache import FileCache
+from ipfs.merkle import files_proof
+from collections import OrderedDict
 from smart_contract.contracts_db import SmartContractDatabase
-from smart_contract.secure_executor import SecureContractExecutor
-from storage.storage_manager import save_node_id, load_node_id, save_key, load_key, save_chain, load_chain, save_peers, load_peers
+from smart_contract.secure_executor import SecureContractExecutor, warm_sandbox_pool
+from smart_contract.state_diff import invoke_payload, invoke_post_state, invoke_state_matches
+from smart_contract.state_codec import state_hash
+from smart_contract.scheduler import run_grouped
+from storage.storage_manager import save_node_id, load_node_id, save_key, load_key, save_chain, load_chain, save_peers, load_peers, save_snapshot, load_snapshot, block_store_path
+from storage.persistence_worker import PersistenceWorker
+from storage.block_store import MappedBlockList
 from ecdsa import VerifyingKey
 import binascii
 import os
@@ -21,6 +30,7 @@ from pathlib import Path
 MAX_CONNECTIONS = 8
 GAS_PRICE = 0.001 # coin per gas unit
 BASE_DEPLOY_COST = 5
+VIEW_CACHE_SIZE = 256 # answers of read-only contract calls the peer keeps
 CONSENSUS ="poa"
 
 def get_random_element(s):
@@ -59,12 +69,17 @@ def get_contract_code_from_notepad():
     return contract_code
 
 class Peer:
-    def __init__(self, host, port, name, activate_disk_load, activate_disk_save):
+    def __init__(self, host, port, name, activate_disk_load, activate_disk_save, activate_block_store="n", activate_pruning="n"):
         self.host = host
         self.port = port
         self.name = name
 
         self.activate_disk_save = activate_disk_save
+        self.persistence = PersistenceWorker(CONSENSUS)
+        """
+            Disk writes are handed to this worker, it coalesces them and
+            flushes from a background thread so handlers never wait on the disk
+        """
 
         self.ipfs_port = port + 50  # API port
         self.gateway_port = port + 81  # Gateway port
@@ -73,6 +88,8 @@ class Peer:
         self.repo_path = Path.home() / f".ipfs_{port}"
         self.env = os.environ.copy()
         self.env["IPFS_PATH"] = str(self.repo_path)
+        self.ipfs = IpfsClient(self.ipfs_port)
+        self.file_cache = FileCache(Path.home() / f".ipfs_cache_{port}")
 
         self.miner = False
         self.miner_task = None
@@ -145,13 +162,29 @@ class Peer:
             if self.activate_disk_save == "y":
                 self.save_key_to_disk()
 
+        if activate_block_store == "y":
+            Chain.block_store = MappedBlockList(block_store_path(CONSENSUS), self.block_to_record, self.record_to_block, valid_chain_length)
+            """
+                Finalized blocks are kept in a memory mapped file and only
+                decoded when accessed, the unfinalized window stays in memory
+            """
+
+        if activate_pruning == "y":
+            Chain.prune_depth = PRUNE_DEPTH
+            """
+                Transactions older than PRUNE_DEPTH finalized blocks are folded
+                into the checkpoint and dropped, only block hashes stay
+            """
+
+        self.contractsDB = SmartContractDatabase()
+        warm_sandbox_pool() # the workers start in the background
+        self.view_cache: OrderedDict = OrderedDict()
+
         if activate_disk_load == "y":
             self.load_chain_from_disk() # If no chain data stored, self.chain will be assigned to None
         else:
             self.chain = None
 
-        self.contractsDB = SmartContractDatabase()
-
         self.mem_pool_condition=asyncio.Condition() 
         """
             Any block under this condition must acquire lock before moving on so we don't need to use both at the same time
@@ -161,11 +194,11 @@ class Peer:
             there is no other such block currently being executed
         """
 
-        self.daemon_process=None
+        self.ipfs_daemon=IpfsDaemon(self.repo_path, self.ipfs, self.ipfs_port, self.gateway_port, self.swarm_tcp, self.swarm_udp)
 
     def save_node_id_to_disk(self):
         node_id = self.node_id
-        save_node_id(node_id, CONSENSUS)
+        self.persistence.mark_dirty("node_id", lambda: node_id, save_node_id, urgent=True)
 
     def load_node_id_from_disk(self):
         node_id = load_node_id(CONSENSUS)
@@ -176,7 +209,7 @@ class Peer:
 
     def save_key_to_disk(self):
         key = self.wallet.private_key_pem
-        save_key(key, CONSENSUS)
+        self.persistence.mark_dirty("keys", lambda: key, save_key, urgent=True)
 
     def load_key_from_disk(self):
         key = load_key(CONSENSUS)
@@ -197,16 +230,43 @@ class Peer:
             block_list.append(block)
 
         self.chain=Chain(blockList=block_list)
+        self.replay_from_snapshot(load_snapshot(CONSENSUS))
+
+    def replay_from_snapshot(self, snapshot):
+        """
+            Restores the state folded into the last snapshot and replays only
+            the blocks stored after it. If there is no snapshot or it doesn't
+            match the stored chain we replay everything from genesis
+        """
+        start=0
+        if snapshot and Chain.instance.restore_checkpoint(snapshot):
+            for contract_id, code in Chain.instance.checkpoint_contracts.items():
+                self.contractsDB.store_contract(contract_id, code)
+            start=Chain.instance.checkpoint_height
+            print(f"\nRestored snapshot at height {start}, replaying {len(Chain.instance.chain)-start} blocks\n")
+
+        for block in Chain.instance.chain[start:]:
+            for transaction in block.transactions:
+                if transaction.receiver == "deploy":
+                    self.deploy_contract(transaction)
 
     def save_chain_to_disk(self):
-        chain = Chain.instance.to_block_dict_list()
-        save_chain(chain, CONSENSUS)
+        if Chain.instance.snapshot_due():
+            Chain.instance.advance_checkpoint()
+        # The snapshot goes first, a chain whose blocks got pruned is useless
+        # without the checkpoint they were folded into
+        if Chain.instance.checkpoint_height:
+            self.persistence.mark_dirty("snapshot", Chain.instance.to_snapshot, save_snapshot)
+        self.persistence.mark_dirty("chain", lambda: Chain.instance.to_block_dict_list(with_files=True), save_chain)
 
     def save_known_peers_to_disk(self):
+        self.persistence.mark_dirty("peers", self.known_peers_to_content, save_peers)
+
+    def known_peers_to_content(self):
         content = {}
         for key, value in self.known_peers.items():
             content[json.dumps(key)] = list(value)
-        save_peers(content, CONSENSUS)
+        return content
 
     def load_known_peers_from_disk(self):
         content = load_peers(CONSENSUS)
@@ -300,8 +360,12 @@ class Peer:
         newBlock.miner_node_id = new_block_miner_node_id
         newBlock.miner_public_key = new_block_miner_public_key
         newBlock.miners_list = new_block_miners_list
-        newBlock.files=block_dict["files"]
+        newBlock.files_root=block_dict.get("files_root")
+        files=block_dict.get("files", {})
+        # A list that doesn't match the root is dropped, it's fetched again from another node
+        newBlock.files=files if newBlock.files_match_root(files) else {}
         newBlock.signature = new_block_signature
+        newBlock.pruned_hash=block_dict.get("pruned_hash")
         return newBlock
 
     def get_public_key_by_node_id(self, target_node_id):
@@ -364,6 +428,15 @@ class Peer:
         except asyncio.CancelledError:
             print("Round calculator task stopped cleanly")
 
+    def block_to_record(self, block: Block):
+        """
+            Dictionary the block store keeps for a finalized block
+        """
+        return block.to_dict(with_files=True)
+
+    def record_to_block(self, record):
+        return self.block_dict_to_block(record)
+
     def valid_deploy_transaction(self, payload):
         contract_code = payload[0]
         gas_used = len(contract_code)//10 + BASE_DEPLOY_COST
@@ -372,22 +445,46 @@ class Peer:
             return False
         return True
 
-    def valid_invoke_transaction(self, payload):
+    async def valid_invoke_transaction(self, payload, pre_state=None, pre_hash=None):
         contract_id = payload[0]
         func_name = payload[1]
         args = payload[2]
-        response = self.run_contract([contract_id, func_name, args])
+        if pre_state is None:
+            pre_state = self.get_contract_state(contract_id)
+            pre_hash = Chain.instance.contract_state_hash(contract_id)
+        response = await self.run_contract([contract_id, func_name, args], pre_state)
         if(response["error"] != None):
             return False
-        state = response["state"]
         gas_used = response["gas_used"]
         amount = gas_used * GAS_PRICE
-        if state != payload[3]:
+        if not invoke_state_matches(payload, pre_state, pre_hash, response["state_hash"]):
             return False
         if amount != payload[-1]:
             return False
         return True
 
+    async def valid_invoke_transactions(self, transactions):
+        """
+            Validates the invoke transactions of a block. Calls to the same
+            contract run in block order, calls to different contracts run
+            concurrently on the sandbox pool. The first call to a contract is
+            checked against its state at our tip, every later one against
+            the state the call before it left
+        """
+        payloads = [transaction.payload for transaction in transactions if transaction.receiver == "invoke"]
+        running_states = {payload[0]: (self.get_contract_state(payload[0]), Chain.instance.contract_state_hash(payload[0])) for payload in payloads}
+
+        async def valid_in_block(payload):
+            pre_state, pre_hash = running_states[payload[0]]
+            if not await self.valid_invoke_transaction(payload, pre_state, pre_hash):
+                return False
+            post_state = invoke_post_state(payload, pre_state)
+            running_states[payload[0]] = (post_state, state_hash(post_state))
+            return True
+
+        results = await run_grouped(payloads, lambda payload: payload[0], valid_in_block)
+        return all(results)
+
     def get_unique_name(self, base_name):
         existing_names = []
         for key, value in self.known_peers.items():
@@ -580,6 +677,15 @@ class Peer:
                 
             await self.broadcast_message(msg)
 
+        elif t=="files":
+            files=msg.get("files")
+            if not isinstance(files, dict):
+                return
+            async with self.file_hashes_lock:
+                self.file_hashes.update(files)
+
+            await self.broadcast_message(msg)
+
         elif t=="network_details_request":
             pkt={
                 "type": "network_details",
@@ -613,7 +719,7 @@ class Peer:
                 if not self.valid_deploy_transaction(transaction.payload):
                     return
             if transaction.receiver == "invoke":
-                if not self.valid_invoke_transaction(transaction.payload):
+                if not await self.valid_invoke_transaction(transaction.payload):
                     return
 
             amount = 0
@@ -649,6 +755,8 @@ class Peer:
 
         elif t=="new_block":
             new_block_dict=msg["block"]
+            # A new block can't be pruned, its hash is always computed from its content
+            new_block_dict.pop("pruned_hash", None)
             newBlock=self.block_dict_to_block(new_block_dict)
             miners_list = self.get_current_miners_list()
             reqd_miner_node_id = miners_list[(len(Chain.instance.chain) + self.round) % len(miners_list)]
@@ -659,14 +767,18 @@ class Peer:
                 return
             
             for transaction in newBlock.transactions:
-                if transaction.receiver == "invoke":
-                    if not self.valid_invoke_transaction(transaction.payload):
-                        return
                 if transaction.receiver == "deploy":
                     if not self.valid_deploy_transaction(transaction.payload):
                         return
+            if not await self.valid_invoke_transactions(newBlock.transactions):
+                return
+            # Other messages are handled while the contracts run
+            if newBlock.prevHash != Chain.instance.lastBlock.hash:
+                print("\nInvalid Block (chain moved on while validating it)\n")
+                return
                     
             Chain.instance.chain.append(newBlock)
+            Chain.instance.prune()
             print("\n\n Block Appended \n\n")
 
             for transaction in newBlock.transactions:
@@ -721,7 +833,9 @@ class Peer:
                 block=self.block_dict_to_block(block_dict)
                 block_list.append(block)
 
-            if not isvalidChain(block_list):
+            # Pruned blocks from a peer are only taken if they are blocks we validated ourselves
+            checkpoint=Chain.instance.checkpoint_for(block_list) if Chain.instance else None
+            if not isvalidChain(block_list, checkpoint):
                 print("\nInvalid Chain\n")
                 return
             #If chain doesn't already exist we assign this as the chain
@@ -731,7 +845,7 @@ class Peer:
                     self.save_chain_to_disk()
 
             elif(len(Chain.instance.chain)<len(block_list)):
-                Chain.instance.rewrite(block_list)
+                Chain.instance.rewrite(block_list, checkpoint)
                 print("\nCurrent chain replaced by longer chain")
                 if self.activate_disk_save == "y":
                     self.save_chain_to_disk()
@@ -744,11 +858,59 @@ class Peer:
                     if Chain.instance.transaction_exists_in_chain(transaction):
                         self.mem_pool.remove(transaction)
 
+            await self.request_block_files(websocket)
+
             async with self.file_hashes_lock:
                 for hash in list(self.file_hashes.keys()):
                     if(Chain.instance.cid_exists_in_chain(hash)):
                         self.file_hashes.pop(hash, None)
 
+        elif t=="block_files_request":
+            if not self.chain:
+                return
+            blocks=[]
+            for height, block_hash in msg.get("blocks", []):
+                if isinstance(height, int) and 0<=height<len(Chain.instance.chain):
+                    block=Chain.instance.chain[height]
+                    if block.hash==block_hash and block.files:
+                        blocks.append([height, block_hash, block.files])
+            pkt={
+                "type":"block_files",
+                "id":str(uuid.uuid4()),
+                "blocks":blocks
+            }
+            await websocket.send(json.dumps(pkt))
+
+        elif t=="block_files":
+            if not self.chain:
+                return
+            filled=False
+            for height, block_hash, files in msg.get("blocks", []):
+                filled=Chain.instance.fill_block_files(height, block_hash, files) or filled
+            if not filled:
+                return
+            async with self.file_hashes_lock:
+                for hash in list(self.file_hashes.keys()):
+                    if(Chain.instance.cid_exists_in_chain(hash)):
+                        self.file_hashes.pop(hash, None)
+            if self.activate_disk_save == "y":
+                self.save_chain_to_disk()
+
+    async def request_block_files(self, websocket):
+        """
+            Asks the node that sent us a chain for the file lists of its
+            batched blocks, chains only carry their roots
+        """
+        missing=Chain.instance.missing_file_lists()
+        if not missing:
+            return
+        pkt={
+            "type":"block_files_request",
+            "id":str(uuid.uuid4()),
+            "blocks":missing
+        }
+        await websocket.send(json.dumps(pkt))
+
     async def handle_connections(self, websocket):
         """
             We handle our server connections from here.
@@ -828,11 +990,7 @@ class Peer:
         await self.broadcast_message(pkt)
 
     def get_contract_state(self, contract_id):
-        for block in reversed(Chain.instance.chain):
-            for transaction in reversed(block.transactions):
-                if transaction.receiver == "invoke" and transaction.payload[0] == contract_id:
-                    return transaction.payload[3]
-        return {}
+        return Chain.instance.contract_state(contract_id)
 
     async def user_input_handler(self):
         """
@@ -898,7 +1056,10 @@ class Peer:
                         args.append(parsed_arg)
                         arg_number += 1
 
-                    response = self.run_contract([contract_id, func_name, args])
+                    # The diff goes against the state the call ran on, the
+                    # contract can move on while we wait for the sandbox
+                    pre_state = self.get_contract_state(contract_id)
+                    response = await self.run_contract([contract_id, func_name, args], pre_state)
                     if(response["error"] != None):
                         print("Error: ", response["error"])
                         continue
@@ -906,7 +1067,7 @@ class Peer:
                     gas_used = response["gas_used"]
                     amount = gas_used * GAS_PRICE
 
-                    payload = [contract_id, func_name, args, state, amount]
+                    payload = invoke_payload(contract_id, func_name, args, pre_state, state, amount)
 
                     if amount<=Chain.instance.calc_balance(self.wallet.public_key, self.mem_pool):
                         await self.create_and_broadcast_tx(rec, payload)
@@ -966,9 +1127,12 @@ class Peer:
                     None, input, "\nEnter description of file: "
                 )
                 path= await asyncio._get_running_loop().run_in_executor(
-                    None, input, "\nEnter path of file: "
+                    None, input, "\nEnter path of file or folder: "
                 )
-                pkt= await self.uploadFile(desc, path)
+                if Path(path).is_dir():
+                    pkt=await self.uploadDirectory(desc, path, print_progress(f"Uploading {path}"))
+                else:
+                    pkt=await self.uploadFile(desc, path, print_progress(f"Uploading {path}"))
                 if(pkt):
                     await self.broadcast_message(pkt)
 
@@ -979,7 +1143,7 @@ class Peer:
                 path= await asyncio._get_running_loop().run_in_executor(
                     None, input, "\nEnter path to download the file: "
                 )
-                download_ipfs_file_subprocess(cid, path)
+                await self.downloadFile(cid, path, print_progress(f"Downloading {cid}"))
 
             elif ch==7:
                 miner_names = list()
@@ -1151,16 +1315,16 @@ class Peer:
                     print(f"Gossip Sampling: Connecting to new peer {new_peer}")
                     asyncio.create_task(self.connect_to_peer(*new_peer))
 
-    async def uploadFile(self, desc: str, path:str):
+    async def uploadFile(self, desc: str, path:str, progress=None):
         file_path=Path(path)
         if(not file_path.is_file()):
             print("\nFile doesn't exist\n")
             return
 
-        if not self.daemon_process: 
-            self.start_daemon()
+        if not await self.ensure_daemon():
+            return
         
-        cid, name = await asyncio.to_thread(addToIpfs, path)
+        cid, name = await self.ipfs.add_async(path, progress)
         if(not(cid and name)):
             return
         
@@ -1177,31 +1341,124 @@ class Peer:
             self.file_hashes[cid]=desc
         return pkt
 
-    def init_repo(self):
+    async def uploadFiles(self, files, progress=None):
+        """
+            Uploads [(desc, path), ...] several at a time and announces all
+            the CIDs in a single "files" packet, which is returned like the
+            "file" packet of uploadFile. None if no file got added
+        """
+        found=[]
+        for desc, path in files:
+            if Path(path).is_file():
+                found.append((desc, path))
+            else:
+                print(f"\nFile {path} doesn't exist\n")
+        if not found:
+            return
+
+        if not await self.ensure_daemon():
+            return
+
+        results=await self.ipfs.add_many_async([path for _, path in found], progress)
+        added={}
+        failed=0
+        for (desc, path), (cid, name) in zip(found, results):
+            if cid and name:
+                added[cid]=desc
+            else:
+                failed+=1
+        print(f"\n{len(added)} New Files Created, {failed} failed\n")
+        if not added:
+            return
+
+        pkt={
+            "type":"files",
+            "id":str(uuid.uuid4()),
+            "files":added
+        }
+
+        self.seen_message_ids.add(pkt["id"])
+        async with self.file_hashes_lock:
+            self.file_hashes.update(added)
+        return pkt
+
+    async def uploadDirectory(self, desc: str, path: str, progress=None):
+        """
+            Uploads every file under the folder at path, each one described
+            by desc followed by its path inside the folder
+        """
+        dir_path=Path(path)
+        if(not dir_path.is_dir()):
+            print("\nFolder doesn't exist\n")
+            return
+
+        files=[]
+        for file_path in sorted(dir_path.rglob("*")):
+            if file_path.is_file():
+                relative=file_path.relative_to(dir_path).as_posix()
+                files.append((f"{desc}/{relative}" if desc else relative, str(file_path)))
+        return await self.uploadFiles(files, progress)
+
+    async def downloadFile(self, cid: str, path: str, progress=None):
+        if await asyncio.to_thread(self.file_cache.copy_to, cid, path):
+            print(f"\nServed {cid} from the file cache\n")
+            return True
+
+        if not await self.ensure_daemon():
+            return False
+        if not await self.ipfs.download_async(cid, path, progress):
+            return False
+        await asyncio.to_thread(self.file_cache.insert, cid, path)
+        return True
+
+    async def streamFile(self, cid: str):
+        """
+            Opens the file for reading in chunks, returns (chunks, size) or (None, None)
+        """
+        chunks, size = self.file_cache.open(cid)
+        if chunks is not None:
+            return chunks, size
+
+        if not await self.ensure_daemon():
+            return None, None
+        chunks, size = await self.ipfs.stream_async(cid)
+        if chunks is None:
+            return None, None
+        return self.file_cache.tee(cid, chunks), size
+
+    def file_block(self, cid: str):
+        """
+            The block that anchors cid as {"cid", "desc", "height", "block_hash"}, None if it isn't on the chain yet
+        """
+        height=Chain.instance.cid_height(cid)
+        if height is None:
+            return None
+        block=Chain.instance.chain[height]
+        info={"cid":cid, "desc":block.files[cid], "height":height, "block_hash":block.hash}
+        if block.files_root:
+            # Enough to check the file against the block header alone
+            info["files_root"]=block.files_root
+            info["proof"]=files_proof(block.files, cid)
+        return info
+
+    async def ensure_daemon(self):
         """
-            Creates a ipfs repo of name ending in ipfs_port_no eg ipfs_5000 
+            Waits until the ipfs daemon answers, starts it if the node didn't already
         """
-        if not self.repo_path.exists():
-            subprocess.run(["ipfs", "init"], env=self.env, check=True)
-            print("\nIPFS repo created\n")
-
-    def configure_ports(self):
-        subprocess.run(["ipfs", "config", "Addresses.API", f"/ip4/127.0.0.1/tcp/{self.ipfs_port}"], env=self.env, check=True)
-        subprocess.run(["ipfs", "config", "Addresses.Gateway", f"/ip4/127.0.0.1/tcp/{self.gateway_port}"], env=self.env, check=True)
-        subprocess.run([
-            "ipfs", "config", "Addresses.Swarm", "--json",
-            f'["/ip4/127.0.0.1/tcp/{self.swarm_tcp}", "/ip4/127.0.0.1/udp/{self.swarm_udp}/quic"]'
-        ], env=self.env, check=True)
-        print("\nConfigured Ports\n")
+        if not await self.ipfs_daemon.wait_ready():
+            print("\nIPFS daemon didn't come up\n")
+            return False
+        return True
 
     def start_daemon(self):
-        self.daemon_process= subprocess.Popen(["ipfs", "daemon"], env=self.env)
-        print("\nIPFS Daemon Started\n")
+        """
+            Brings the ipfs daemon up in the background, creating the repo ~/.ipfs_<port> on first use
+        """
+        self.ipfs_daemon.start()
 
     def stop_daemon(self):
-        if self.daemon_process:
-            self.daemon_process.terminate()
-            self.daemon_process.wait()
+        self.ipfs_daemon.stop()
+        self.ipfs.close()
 
     def sign_block(self, block: Block):
         message = block.get_message_to_sign()
@@ -1228,6 +1485,7 @@ class Peer:
                                     continue
                                 else:
                                     transaction_list.append(transaction)
+                            transaction_list=Chain.instance.mineable_transactions(transaction_list)
 
                             if(len(transaction_list)>0):
                                 print("Mining Started")
@@ -1236,7 +1494,7 @@ class Peer:
                                 newBlock.miner_node_id = self.node_id
                                 newBlock.miner_public_key = self.wallet.public_key
                                 newBlock.miners_list = miners_list
-                                newBlock.files=self.file_hashes.copy()
+                                newBlock.anchor_files(self.file_hashes.copy())
                                 self.sign_block(newBlock)
 
                                 reqd_miner_pulic_key = self.wallet.public_key
@@ -1245,6 +1503,7 @@ class Peer:
                                     return
                         
                                 Chain.instance.chain.append(newBlock)
+                                Chain.instance.prune()
                                 print("\nBlock Appended \n")
 
                                 for transaction in newBlock.transactions:
@@ -1263,7 +1522,7 @@ class Peer:
                                 pkt={
                                     "type":"new_block",
                                     "id":str(uuid.uuid4()),
-                                    "block":newBlock.to_dict()
+                                    "block":newBlock.to_dict(with_files=True)
                                 }
 
                                 self.seen_message_ids.add(pkt["id"])
@@ -1319,19 +1578,46 @@ class Peer:
         self.contractsDB.store_contract(contract_id, code)
         print("Contract deployed with id: ", contract_id)
 
-    def run_contract(self, payload):
+    async def run_contract(self, payload, state=None):
         contract_id, func_name, args = payload[0], payload[1], payload[2]
         code = self.contractsDB.get_contract(contract_id)
         if code is None:
             raise Exception(f"Contract '{contract_id}' not found.")
 
-        state = self.get_contract_state(contract_id)
-        executor = SecureContractExecutor(code)
-        response = executor.run(func_name, args, state)
+        if state is None:
+            state = self.get_contract_state(contract_id)
+        executor = SecureContractExecutor(code, self.contractsDB.get_compiled(contract_id))
+        response = await executor.run_async(func_name, args, state)
+
+        return response
+
+    async def view_contract(self, contract_id, func_name, args):
+        """
+            Runs a contract function against the contract's current state
+            without a transaction, nothing is charged and the state it returns
+            is thrown away. Answers are cached per contract, function,
+            arguments and state hash, so polling a contract is mostly free
+        """
+        if self.contractsDB.get_contract(contract_id) is None:
+            raise Exception(f"Contract '{contract_id}' not found.")
 
+        key=(contract_id, func_name, json.dumps(args, sort_keys=True, default=repr), Chain.instance.contract_state_hash(contract_id))
+        response=self.view_cache.get(key)
+        if response is not None:
+            self.view_cache.move_to_end(key)
+            return response
+
+        response=await self.run_contract([contract_id, func_name, args])
+        # Timeouts and crashes say nothing about the contract, don't keep them
+        if response["success"]:
+            self.view_cache[key]=response
+            if len(self.view_cache)>VIEW_CACHE_SIZE:
+                self.view_cache.popitem(last=False)
         return response
 
     async def start(self, bootstrap_host=None, bootstrap_port=None):
+        self.persistence.start()
+
         # We start the server
         await websockets.serve(self.handle_connections, self.host, self.port)
         # We await the setting up of the server and the handle connections funciton,
@@ -1347,6 +1633,7 @@ class Peer:
             Chain.instance.chain[0].miner_public_key = self.wallet.public_key
             Chain.instance.chain[0].miners_list = [self.node_id]
             self.sign_block(Chain.instance.chain[0])
+            Chain.instance.block_updated(0)
             self.admin_id = self.node_id
             await self.update_role(True)
 
@@ -1356,17 +1643,17 @@ class Peer:
         sampler_task = asyncio.create_task(self.gossip_peer_sampler())
         self.round_task = asyncio.create_task(self.round_calculator())
 
-        self.init_repo()
-        self.configure_ports()
+        self.start_daemon()
 
         await inp_task
 
+        await self.persistence.stop()
+
         consensus_task.cancel()
         disc_task.cancel()
         sampler_task.cancel()
         self.round_task.cancel()
 
-        if self.daemon_process:
-            self.stop_daemon()
+        self.stop_daemon()
 
         await self.update_role(False)
\ No newline at end of file
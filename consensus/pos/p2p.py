@@ -3,11 +3,20 @@ import argparse, json, uuid, base64
 import threading, socket, os, subprocess
 from datetime import datetime, timedelta
 from typing import Set, Dict, List, Tuple, Any
-from consensus.pos.blockchain_structures import Transaction, Stake, Block, Wallet, Chain, isvalidChain, weight_of_chain
-from ipfs.ipfs import addToIpfs, download_ipfs_file_subprocess
+from consensus.pos.blockchain_structures import Transaction, Stake, Block, Wallet, Chain, isvalidChain, valid_chain_length, PRUNE_DEPTH
+from ipfs.daemon import IpfsDaemon
+from ipfs.ipfs_client import IpfsClient, print_progress
+from ipfs.file_cache import FileCache
+from ipfs.merkle import files_proof
+from collections import OrderedDict
 from smart_contract.contracts_db import SmartContractDatabase
-from smart_contract.secure_executor import SecureContractExecutor
-from storage.storage_manager import save_key, load_key, save_chain, load_chain, save_peers, load_peers
+from smart_contract.secure_executor import SecureContractExecutor, warm_sandbox_pool
+from smart_contract.state_diff import invoke_payload, invoke_post_state, invoke_state_matches
+from smart_contract.state_codec import state_hash
+from smart_contract.scheduler import run_grouped
+from storage.storage_manager import save_key, load_key, save_chain, load_chain, save_peers, load_peers, save_snapshot, load_snapshot, block_store_path
+from storage.persistence_worker import PersistenceWorker
+from storage.block_store import MappedBlockList
 from ecdsa import VerifyingKey, BadSignatureError
 import tempfile
 from pathlib import Path
@@ -18,6 +27,7 @@ MAX_OUTPUT=2**256
 EPOCH_TIME=60
 GAS_PRICE = 0.001 # coin per gas unit
 BASE_DEPLOY_COST = 5
+VIEW_CACHE_SIZE = 256 # answers of read-only contract calls the peer keeps
 CONSENSUS ="pos"
 
 class VrfThresholdException(Exception):
@@ -59,12 +69,17 @@ def get_contract_code_from_notepad():
     return contract_code
 
 class Peer:
-    def __init__(self, host, port, name, staker:bool, activate_disk_load, activate_disk_save):
+    def __init__(self, host, port, name, staker:bool, activate_disk_load, activate_disk_save, activate_block_store="n", activate_pruning="n"):
         self.host = host
         self.name = name
         self.staker=staker
 
         self.activate_disk_save = activate_disk_save
+        self.persistence = PersistenceWorker(CONSENSUS)
+        """
+            Disk writes are handed to this worker, it coalesces them and
+            flushes from a background thread so handlers never wait on the disk
+        """
 
         self.port = port
         self.ipfs_port = port + 50  # API port
@@ -74,6 +89,8 @@ class Peer:
         self.repo_path = Path.home() / f".ipfs_{port}"
         self.env = os.environ.copy()
         self.env["IPFS_PATH"] = str(self.repo_path)
+        self.ipfs = IpfsClient(self.ipfs_port)
+        self.file_cache = FileCache(Path.home() / f".ipfs_cache_{port}")
 
         self.server_connections :Set[websockets.WebSocketServerProtocol]=set() # For inbound peers ie websockets that connect to us and treat us as the server
         self.client_connections :Set[websockets.WebSocketServerProtocol]=set() # For outbound peers ie websockets we initiated, we are the clients
@@ -118,7 +135,7 @@ class Peer:
         
         self.file_hashes: Dict[str, str]={}
         self.file_hashes_lock=asyncio.Lock()
-        self.daemon_process=None
+        self.ipfs_daemon=IpfsDaemon(self.repo_path, self.ipfs, self.ipfs_port, self.gateway_port, self.swarm_tcp, self.swarm_udp)
 
         self.current_stakes: set[Stake]=set() # Public key is stored as pem string
         self.current_stakers:Dict[str, int]={}
@@ -135,13 +152,29 @@ class Peer:
             if self.activate_disk_save == "y":
                 self.save_key_to_disk()
         
+        if activate_block_store == "y":
+            Chain.block_store = MappedBlockList(block_store_path(CONSENSUS), self.block_to_record, self.record_to_block, valid_chain_length, record_keys=("is_valid", "slash_creator"))
+            """
+                Finalized blocks are kept in a memory mapped file and only
+                decoded when accessed, the unfinalized window stays in memory
+            """
+
+        if activate_pruning == "y":
+            Chain.prune_depth = PRUNE_DEPTH
+            """
+                Transactions older than PRUNE_DEPTH finalized blocks are folded
+                into the checkpoint and dropped, only block hashes stay
+            """
+
+        self.contractsDB = SmartContractDatabase()
+        warm_sandbox_pool() # the workers start in the background
+        self.view_cache: OrderedDict = OrderedDict()
+
         if activate_disk_load == "y":
             self.load_chain_from_disk() # If no chain data stored, self.chain will be assigned to None
         else:
             self.chain = None
 
-        self.contractsDB = SmartContractDatabase()
-
         self.create_block_condition=asyncio.Condition()
         """
             Starts a timer for the creation of next block
@@ -150,7 +183,7 @@ class Peer:
 
     def save_key_to_disk(self):
         key = self.wallet.private_key_pem
-        save_key(key, CONSENSUS)
+        self.persistence.mark_dirty("keys", lambda: key, save_key, urgent=True)
 
     def load_key_from_disk(self):
         key = load_key(CONSENSUS)
@@ -171,16 +204,43 @@ class Peer:
             block_list.append(block)
 
         self.chain=Chain(blockList=block_list)
+        self.replay_from_snapshot(load_snapshot(CONSENSUS))
+
+    def replay_from_snapshot(self, snapshot):
+        """
+            Restores the state folded into the last snapshot and replays only
+            the blocks stored after it. If there is no snapshot or it doesn't
+            match the stored chain we replay everything from genesis
+        """
+        start=0
+        if snapshot and Chain.instance.restore_checkpoint(snapshot):
+            for contract_id, code in Chain.instance.checkpoint_contracts.items():
+                self.contractsDB.store_contract(contract_id, code)
+            start=Chain.instance.checkpoint_height
+            print(f"\nRestored snapshot at height {start}, replaying {len(Chain.instance.chain)-start} blocks\n")
+
+        for block in Chain.instance.chain[start:]:
+            for transaction in block.transactions:
+                if transaction.receiver == "deploy":
+                    self.deploy_contract(transaction)
 
     def save_chain_to_disk(self):
-        chain = Chain.instance.to_block_dict_list()
-        save_chain(chain, CONSENSUS)
+        if Chain.instance.snapshot_due():
+            Chain.instance.advance_checkpoint()
+        # The snapshot goes first, a chain whose blocks got pruned is useless
+        # without the checkpoint they were folded into
+        if Chain.instance.checkpoint_height:
+            self.persistence.mark_dirty("snapshot", Chain.instance.to_snapshot, save_snapshot)
+        self.persistence.mark_dirty("chain", lambda: Chain.instance.to_block_dict_list(with_files=True), save_chain)
 
     def save_known_peers_to_disk(self):
+        self.persistence.mark_dirty("peers", self.known_peers_to_content, save_peers)
+
+    def known_peers_to_content(self):
         content = {}
         for key, value in self.known_peers.items():
             content[json.dumps(key)] = list(value)
-        save_peers(content, CONSENSUS)
+        return content
 
     def load_known_peers_from_disk(self):
         content = load_peers(CONSENSUS)
@@ -247,7 +307,7 @@ class Peer:
                 transaction.sign=base64.b64decode(transaction_dict["sign"])
             transactions.append(transaction)
         
-        if(not(new_block_id and new_block_ts and transactions)): # Genesis block doesn't have prevHash, it's an empty string
+        if(not(new_block_id and new_block_ts and (transactions or block_dict.get("pruned_hash")))): # Genesis block doesn't have prevHash, it's an empty string
             return None
         
         newBlock=Block(new_block_prevHash, transactions, new_block_ts, new_block_id)   
@@ -255,7 +315,9 @@ class Peer:
         if(staked_amt):
             newBlock.staked_amt=staked_amt
 
-        if(block_dict.get("files")):
+        newBlock.files_root=block_dict.get("files_root")
+        # A list that doesn't match the root is dropped, it's fetched again from another node
+        if(block_dict.get("files") and newBlock.files_match_root(block_dict["files"])):
             newBlock.files=block_dict["files"]
 
         creator=block_dict.get("creator")
@@ -281,6 +343,7 @@ class Peer:
             newBlock.seed=seed
 
         newBlock.stakers=stakers_list
+        newBlock.pruned_hash=block_dict.get("pruned_hash")
         return newBlock
     
     def stake_dict_to_stake(self, stake_dict:Dict[str, Any]):    
@@ -304,6 +367,24 @@ class Peer:
         stake.sign=sign_bytes
         return stake
 
+    def block_to_record(self, block: Block):
+        """
+            Dictionary the block store keeps for a finalized block, on top of
+            what we send to peers it has the slashing flags of the block
+        """
+        record=block.to_dict_with_stakers(with_files=True)
+        if block.sign:
+            record["sign"]=base64.b64encode(block.sign).decode()
+        record["is_valid"]=block.is_valid
+        record["slash_creator"]=block.slash_creator
+        return record
+
+    def record_to_block(self, record):
+        block=self.block_dict_to_block(record)
+        block.is_valid=record.get("is_valid", True)
+        block.slash_creator=record.get("slash_creator", False)
+        return block
+
     def valid_deploy_transaction(self, payload):
         contract_code = payload[0]
         gas_used = len(contract_code)//10 + BASE_DEPLOY_COST
@@ -312,22 +393,46 @@ class Peer:
             return False
         return True
 
-    def valid_invoke_transaction(self, payload):
+    async def valid_invoke_transaction(self, payload, pre_state=None, pre_hash=None):
         contract_id = payload[0]
         func_name = payload[1]
         args = payload[2]
-        response = self.run_contract([contract_id, func_name, args])
+        if pre_state is None:
+            pre_state = self.get_contract_state(contract_id)
+            pre_hash = Chain.instance.contract_state_hash(contract_id)
+        response = await self.run_contract([contract_id, func_name, args], pre_state)
         if(response["error"] != None):
             return False
-        state = response["state"]
         gas_used = response["gas_used"]
         amount = gas_used * GAS_PRICE
-        if state != payload[3]:
+        if not invoke_state_matches(payload, pre_state, pre_hash, response["state_hash"]):
             return False
         if amount != payload[-1]:
             return False
         return True
 
+    async def valid_invoke_transactions(self, transactions):
+        """
+            Validates the invoke transactions of a block. Calls to the same
+            contract run in block order, calls to different contracts run
+            concurrently on the sandbox pool. The first call to a contract is
+            checked against its state at our tip, every later one against
+            the state the call before it left
+        """
+        payloads = [transaction.payload for transaction in transactions if transaction.receiver == "invoke"]
+        running_states = {payload[0]: (self.get_contract_state(payload[0]), Chain.instance.contract_state_hash(payload[0])) for payload in payloads}
+
+        async def valid_in_block(payload):
+            pre_state, pre_hash = running_states[payload[0]]
+            if not await self.valid_invoke_transaction(payload, pre_state, pre_hash):
+                return False
+            post_state = invoke_post_state(payload, pre_state)
+            running_states[payload[0]] = (post_state, state_hash(post_state))
+            return True
+
+        results = await run_grouped(payloads, lambda payload: payload[0], valid_in_block)
+        return all(results)
+
     def get_unique_name(self, base_name):
         existing_names = []
         for key, value in self.known_peers.items():
@@ -505,6 +610,16 @@ class Peer:
 
             await self.broadcast_message(msg)
 
+        elif t == "files":
+            files = msg.get("files")
+            if not isinstance(files, dict):
+                return
+
+            async with self.file_hashes_lock:
+                self.file_hashes.update(files)
+
+            await self.broadcast_message(msg)
+
         elif t == "new_tx":
             tx_str = msg.get("transaction")
             sender_pem = msg.get("sender_pem")
@@ -548,7 +663,7 @@ class Peer:
                 if not self.valid_deploy_transaction(transaction.payload):
                     return
             if transaction.receiver == "invoke":
-                if not self.valid_invoke_transaction(transaction.payload):
+                if not await self.valid_invoke_transaction(transaction.payload):
                     return
                 
             if amount > Chain.instance.calc_balance(transaction.sender, self.mem_pool, list(self.current_stakes)):
@@ -627,7 +742,11 @@ class Peer:
             if "creator" not in new_block_dict:
                 return
             
+            # A new block can't be pruned, its hash is always computed from its content
+            new_block_dict.pop("pruned_hash", None)
             newBlock = self.block_dict_to_block(new_block_dict)
+            if not newBlock:
+                return
 
             if not Chain.instance.isValidBlock(newBlock):
                 print("\nInvalid Block\n")
@@ -748,15 +867,19 @@ class Peer:
             
                 
             for transaction in newBlock.transactions:
-                if transaction.receiver == "invoke":
-                    if not self.valid_invoke_transaction(transaction.payload):
-                        return
                 if transaction.receiver == "deploy":
                     if not self.valid_deploy_transaction(transaction.payload):
                         return
+            if not await self.valid_invoke_transactions(newBlock.transactions):
+                return
+            # Other messages are handled while the contracts run
+            if newBlock.prevHash != Chain.instance.lastBlock.hash:
+                print("\nInvalid Block (chain moved on while validating it)\n")
+                return
 
             newBlock.creator = new_block_dict["creator"]
             Chain.instance.chain.append(newBlock)
+            Chain.instance.prune()
             print("\n\n Block Appended \n\n")
             self.last_epoch_end_ts = datetime.now()
 
@@ -810,7 +933,7 @@ class Peer:
             except Exception:
                 return
 
-            if pos < 0 or pos >= len(Chain.instance.chain):
+            if pos < Chain.instance.pruned_height or pos >= len(Chain.instance.chain):
                 return
 
             block1_exists = Chain.instance.chain[pos].is_equal(block1)
@@ -839,12 +962,15 @@ class Peer:
                 print(f"\nBlock {pos} slashed\n")
                 Chain.instance.chain[pos].is_valid = False
                 Chain.instance.chain[pos].slash_creator = True
+                Chain.instance.block_updated(pos)
                 await self.broadcast_message(msg)
 
             # Fork still exists but longest chain will win
 
             elif (err1 and not err2 and block1_exists) or (err2 and not err1 and block2_exists):
                 Chain.instance.chain = Chain.instance.chain[:pos]
+                if pos < Chain.instance.checkpoint_height:
+                    Chain.instance.reset_checkpoint()
                 # We trim the chain, eventually when a longer chain arrives it will replace this, but this is unlikely too since we don't share slash_announcement in such cases
                 # hmm this means err1 exists but block1 also exists so we trim back to before that block
                 # :pos is not included
@@ -872,7 +998,9 @@ class Peer:
                 block = self.block_dict_to_block(block_dict)
                 block_list.append(block)
 
-            if not isvalidChain(block_list):
+            # Pruned blocks from a peer are only taken if they are blocks we validated ourselves
+            checkpoint = Chain.instance.checkpoint_for(block_list) if Chain.instance else None
+            if not isvalidChain(block_list, checkpoint):
                 print("\nInvalid Chain\n")
                 return
 
@@ -892,14 +1020,15 @@ class Peer:
                         l1 = len(Chain.instance.chain)
                         l2 = len(block_list)
                         if l2 > l1:
-                            Chain.instance.rewrite(block_list)
+                            Chain.instance.rewrite(block_list, checkpoint)
                             if self.activate_disk_save == "y":
                                 self.save_chain_to_disk()
                     else:  # Malicious fork
                         await self.verify_and_slash(block1, block2, pos, block_list)
                         
-                elif weight_of_chain(Chain.instance.chain) < weight_of_chain(block_list):
-                    Chain.instance.rewrite(block_list)
+                # No fork, one chain is a prefix of the other
+                elif Chain.instance.outweighed_by(block_list, min(len(Chain.instance.chain), len(block_list))):
+                    Chain.instance.rewrite(block_list, checkpoint)
                     print("\nCurrent chain replaced by heavier chain\n")
                     if self.activate_disk_save == "y":
                         self.save_chain_to_disk()
@@ -912,12 +1041,48 @@ class Peer:
                     if Chain.instance.transaction_exists_in_chain(transaction):
                         self.mem_pool.remove(transaction)
             
+            await self.request_block_files(websocket)
+
             async with self.file_hashes_lock:
                 for hash in list(self.file_hashes.keys()):
                     if Chain.instance.cid_exists_in_chain(hash):
                         self.file_hashes.pop(hash, None)
 
+        elif t=="block_files_request":
+            if not self.chain:
+                return
+            blocks=[]
+            for height, block_hash in msg.get("blocks", []):
+                if isinstance(height, int) and 0<=height<len(Chain.instance.chain):
+                    block=Chain.instance.chain[height]
+                    if block.hash==block_hash and block.files:
+                        blocks.append([height, block_hash, block.files])
+            pkt={
+                "type":"block_files",
+                "id":str(uuid.uuid4()),
+                "blocks":blocks
+            }
+            await websocket.send(json.dumps(pkt))
+
+        elif t=="block_files":
+            if not self.chain:
+                return
+            filled=False
+            for height, block_hash, files in msg.get("blocks", []):
+                filled=Chain.instance.fill_block_files(height, block_hash, files) or filled
+            if not filled:
+                return
+            async with self.file_hashes_lock:
+                for hash in list(self.file_hashes.keys()):
+                    if(Chain.instance.cid_exists_in_chain(hash)):
+                        self.file_hashes.pop(hash, None)
+            if self.activate_disk_save == "y":
+                self.save_chain_to_disk()
+
     async def verify_and_slash(self, block1:Block, block2:Block, pos:int, block_list:List[Block]):
+        if pos<Chain.instance.pruned_height: # Nothing left to compare or to slash
+            return
+
         vk=VerifyingKey.from_pem(block1.creator)
         sign1=block1.sign
         sign2=block2.sign
@@ -944,6 +1109,7 @@ class Peer:
         
         Chain.instance.chain[pos].is_valid=False
         Chain.instance.chain[pos].slash_creator=True
+        Chain.instance.block_updated(pos)
         
         pkt={
             "type":"slash_announcement",
@@ -958,6 +1124,21 @@ class Peer:
         # Now the receiver should make sure that the block1 creator signed both the blocks and it is he that is penalized in slash_block, also check my signature 
         # Then if Chain.instance.chain[pos]==block1 or block2 then make that block invalid and slash the creator
         
+    async def request_block_files(self, websocket):
+        """
+            Asks the node that sent us a chain for the file lists of its
+            batched blocks, chains only carry their roots
+        """
+        missing=Chain.instance.missing_file_lists()
+        if not missing:
+            return
+        pkt={
+            "type":"block_files_request",
+            "id":str(uuid.uuid4()),
+            "blocks":missing
+        }
+        await websocket.send(json.dumps(pkt))
+
     async def handle_connections(self, websocket):
         """
             We handle our server connections from here.
@@ -1039,11 +1220,7 @@ class Peer:
         await self.broadcast_message(pkt)
 
     def get_contract_state(self, contract_id):
-        for block in reversed(Chain.instance.chain):
-            for transaction in reversed(block.transactions):
-                if transaction.receiver == "invoke" and transaction.payload[0] == contract_id:
-                    return transaction.payload[3]
-        return {}
+        return Chain.instance.contract_state(contract_id)
 
     async def user_input_handler(self):
         """
@@ -1109,7 +1286,10 @@ class Peer:
                         args.append(parsed_arg)
                         arg_number += 1
 
-                    response = self.run_contract([contract_id, func_name, args])
+                    # The diff goes against the state the call ran on, the
+                    # contract can move on while we wait for the sandbox
+                    pre_state = self.get_contract_state(contract_id)
+                    response = await self.run_contract([contract_id, func_name, args], pre_state)
                     if(response["error"] != None):
                         print("Error: ", response["error"])
                         continue
@@ -1117,7 +1297,7 @@ class Peer:
                     gas_used = response["gas_used"]
                     amount = gas_used * GAS_PRICE
 
-                    payload = [contract_id, func_name, args, state, amount]
+                    payload = invoke_payload(contract_id, func_name, args, pre_state, state, amount)
 
                     if amount<=Chain.instance.calc_balance(self.wallet.public_key_pem, self.mem_pool, list(self.current_stakes)):
                         await self.create_and_broadcast_tx(rec, payload)
@@ -1192,9 +1372,12 @@ class Peer:
                     None, input, "\nEnter description of file: "
                 )
                 path= await asyncio._get_running_loop().run_in_executor(
-                    None, input, "\nEnter path of file: "
+                    None, input, "\nEnter path of file or folder: "
                 )
-                pkt=await self.uploadFile(desc, path)
+                if Path(path).is_dir():
+                    pkt=await self.uploadDirectory(desc, path, print_progress(f"Uploading {path}"))
+                else:
+                    pkt=await self.uploadFile(desc, path, print_progress(f"Uploading {path}"))
                 await self.broadcast_message(pkt)
 
             elif ch==8:
@@ -1204,7 +1387,7 @@ class Peer:
                 path= await asyncio._get_running_loop().run_in_executor(
                     None, input, "\nEnter path to download the file: "
                 )
-                download_ipfs_file_subprocess(cid, path)
+                await self.downloadFile(cid, path, print_progress(f"Downloading {cid}"))
 
             elif ch==9:
                 if(not self.staker):
@@ -1257,16 +1440,16 @@ class Peer:
                 print("Quitting...")
                 break
     
-    async def uploadFile(self, desc: str, path:str):
+    async def uploadFile(self, desc: str, path:str, progress=None):
         file_path=Path(path)
         if(not file_path.is_file()):
             print("\nFile doesn't exist\n")
             return
 
-        if not self.daemon_process: 
-            self.start_daemon()
+        if not await self.ensure_daemon():
+            return
         
-        cid, name = await asyncio.to_thread(addToIpfs, path)
+        cid, name = await self.ipfs.add_async(path, progress)
         if(not(cid and name)):
             return
         
@@ -1283,31 +1466,124 @@ class Peer:
             self.file_hashes[cid]=desc
         return pkt
 
-    def init_repo(self):
+    async def uploadFiles(self, files, progress=None):
         """
-            Creates a ipfs repo of name ending in ipfs_port_no eg ipfs_5000 
+            Uploads [(desc, path), ...] several at a time and announces all
+            the CIDs in a single "files" packet, which is returned like the
+            "file" packet of uploadFile. None if no file got added
         """
-        if not self.repo_path.exists():
-            subprocess.run(["ipfs", "init"], env=self.env, check=True)
-            print("\nIPFS repo created\n")
-
-    def configure_ports(self):
-        subprocess.run(["ipfs", "config", "Addresses.API", f"/ip4/127.0.0.1/tcp/{self.ipfs_port}"], env=self.env, check=True)
-        subprocess.run(["ipfs", "config", "Addresses.Gateway", f"/ip4/127.0.0.1/tcp/{self.gateway_port}"], env=self.env, check=True)
-        subprocess.run([
-            "ipfs", "config", "Addresses.Swarm", "--json",
-            f'["/ip4/127.0.0.1/tcp/{self.swarm_tcp}", "/ip4/127.0.0.1/udp/{self.swarm_udp}/quic"]'
-        ], env=self.env, check=True)
-        print("\nConfigured Ports\n")
+        found=[]
+        for desc, path in files:
+            if Path(path).is_file():
+                found.append((desc, path))
+            else:
+                print(f"\nFile {path} doesn't exist\n")
+        if not found:
+            return
+
+        if not await self.ensure_daemon():
+            return
+
+        results=await self.ipfs.add_many_async([path for _, path in found], progress)
+        added={}
+        failed=0
+        for (desc, path), (cid, name) in zip(found, results):
+            if cid and name:
+                added[cid]=desc
+            else:
+                failed+=1
+        print(f"\n{len(added)} New Files Created, {failed} failed\n")
+        if not added:
+            return
+
+        pkt={
+            "type":"files",
+            "id":str(uuid.uuid4()),
+            "files":added
+        }
+
+        self.seen_message_ids.add(pkt["id"])
+        async with self.file_hashes_lock:
+            self.file_hashes.update(added)
+        return pkt
+
+    async def uploadDirectory(self, desc: str, path: str, progress=None):
+        """
+            Uploads every file under the folder at path, each one described
+            by desc followed by its path inside the folder
+        """
+        dir_path=Path(path)
+        if(not dir_path.is_dir()):
+            print("\nFolder doesn't exist\n")
+            return
+
+        files=[]
+        for file_path in sorted(dir_path.rglob("*")):
+            if file_path.is_file():
+                relative=file_path.relative_to(dir_path).as_posix()
+                files.append((f"{desc}/{relative}" if desc else relative, str(file_path)))
+        return await self.uploadFiles(files, progress)
+
+    async def downloadFile(self, cid: str, path: str, progress=None):
+        if await asyncio.to_thread(self.file_cache.copy_to, cid, path):
+            print(f"\nServed {cid} from the file cache\n")
+            return True
+
+        if not await self.ensure_daemon():
+            return False
+        if not await self.ipfs.download_async(cid, path, progress):
+            return False
+        await asyncio.to_thread(self.file_cache.insert, cid, path)
+        return True
+
+    async def streamFile(self, cid: str):
+        """
+            Opens the file for reading in chunks, returns (chunks, size) or (None, None)
+        """
+        chunks, size = self.file_cache.open(cid)
+        if chunks is not None:
+            return chunks, size
+
+        if not await self.ensure_daemon():
+            return None, None
+        chunks, size = await self.ipfs.stream_async(cid)
+        if chunks is None:
+            return None, None
+        return self.file_cache.tee(cid, chunks), size
+
+    def file_block(self, cid: str):
+        """
+            The block that anchors cid as {"cid", "desc", "height", "block_hash"}, None if it isn't on the chain yet
+        """
+        height=Chain.instance.cid_height(cid)
+        if height is None:
+            return None
+        block=Chain.instance.chain[height]
+        info={"cid":cid, "desc":block.files[cid], "height":height, "block_hash":block.hash}
+        if block.files_root:
+            # Enough to check the file against the block header alone
+            info["files_root"]=block.files_root
+            info["proof"]=files_proof(block.files, cid)
+        return info
+
+    async def ensure_daemon(self):
+        """
+            Waits until the ipfs daemon answers, starts it if the node didn't already
+        """
+        if not await self.ipfs_daemon.wait_ready():
+            print("\nIPFS daemon didn't come up\n")
+            return False
+        return True
 
     def start_daemon(self):
-        self.daemon_process= subprocess.Popen(["ipfs", "daemon"], env=self.env)
-        print("\nIPFS Daemon Started\n")
+        """
+            Brings the ipfs daemon up in the background, creating the repo ~/.ipfs_<port> on first use
+        """
+        self.ipfs_daemon.start()
 
     def stop_daemon(self):
-        if self.daemon_process:
-            self.daemon_process.terminate()
-            self.daemon_process.wait()
+        self.ipfs_daemon.stop()
+        self.ipfs.close()
 
     async def connect_to_peer(self, host, port):
         """
@@ -1474,6 +1750,7 @@ class Peer:
         for transaction in transactions_in_mem_pool:
             if(not Chain.instance.transaction_exists_in_chain(transaction)):
                 pending_transactions.append(transaction)
+        pending_transactions=Chain.instance.mineable_transactions(pending_transactions)
         
         if(len(pending_transactions)<=0):
             print("\nNo pending transactions\n")
@@ -1502,10 +1779,11 @@ class Peer:
             #The following code is for the winner
             print("\nYou won\n")
             newBlock=Block(Chain.instance.lastBlock.hash, pending_transactions)
-            newBlock.files=self.file_hashes.copy()
+            newBlock.anchor_files(self.file_hashes.copy())
             newBlock.seed=seed
             newBlock.vrf_proof=vrf_proof
             Chain.instance.chain.append(newBlock)
+            Chain.instance.prune()
             newBlock.staked_amt=self.staked_amt
             newBlock.creator=self.wallet.public_key_pem
             newBlock.stakers=self.current_stakers
@@ -1534,7 +1812,7 @@ class Peer:
             pkt={
                 "type":"new_block",
                 "id":str(uuid.uuid4()),
-                "block":newBlock.to_dict_with_stakers(),
+                "block":newBlock.to_dict_with_stakers(with_files=True),
                 "vrf_proof":vrf_proof_b64,
                 "sign":sign_b64,
             }
@@ -1583,19 +1861,46 @@ class Peer:
         self.contractsDB.store_contract(contract_id, code)
         print("Contract deployed with id: ", contract_id)
 
-    def run_contract(self, payload):
+    async def run_contract(self, payload, state=None):
         contract_id, func_name, args = payload[0], payload[1], payload[2]
         code = self.contractsDB.get_contract(contract_id)
         if code is None:
             raise Exception(f"Contract '{contract_id}' not found.")
 
-        state = self.get_contract_state(contract_id)
-        executor = SecureContractExecutor(code)
-        response = executor.run(func_name, args, state)
+        if state is None:
+            state = self.get_contract_state(contract_id)
+        executor = SecureContractExecutor(code, self.contractsDB.get_compiled(contract_id))
+        response = await executor.run_async(func_name, args, state)
 
         return response
 
+    async def view_contract(self, contract_id, func_name, args):
+        """
+            Runs a contract function against the contract's current state
+            without a transaction, nothing is charged and the state it returns
+            is thrown away. Answers are cached per contract, function,
+            arguments and state hash, so polling a contract is mostly free
+        """
+        if self.contractsDB.get_contract(contract_id) is None:
+            raise Exception(f"Contract '{contract_id}' not found.")
+
+        key=(contract_id, func_name, json.dumps(args, sort_keys=True, default=repr), Chain.instance.contract_state_hash(contract_id))
+        response=self.view_cache.get(key)
+        if response is not None:
+            self.view_cache.move_to_end(key)
+            return response
+
+        response=await self.run_contract([contract_id, func_name, args])
+        # Timeouts and crashes say nothing about the contract, don't keep them
+        if response["success"]:
+            self.view_cache[key]=response
+            if len(self.view_cache)>VIEW_CACHE_SIZE:
+                self.view_cache.popitem(last=False)
+        return response
+
     async def start(self, bootstrap_host=None, bootstrap_port=None):
+        self.persistence.start()
+
         # We start the server
         await websockets.serve(self.handle_connections, self.host, self.port)
         # We await the setting up of the server and the handle connections funciton,
@@ -1616,10 +1921,15 @@ class Peer:
         disc_task=asyncio.create_task(self.discover_peers())
         sampler_task = asyncio.create_task(self.gossip_peer_sampler())
 
+        self.start_daemon()
 
         await inp_task
 
+        await self.persistence.stop()
+
         reset_task.cancel()
         disc_task.cancel()
         consensus_task.cancel()
-        sampler_task.cancel()
\ No newline at end of file
+        sampler_task.cancel()
+
+        self.stop_daemon()
\ No newline at end of file
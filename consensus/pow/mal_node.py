@@ -4,9 +4,14 @@ import threading, socket
 import os, subprocess
 from typing import Set, Dict, List, Tuple
 from consensus.pow.blockchain_structures import Transaction, Block, Wallet, Chain, isvalidChain
-from ipfs.ipfs import addToIpfs, download_ipfs_file_subprocess
+from ipfs.daemon import IpfsDaemon
+from ipfs.ipfs_client import IpfsClient, print_progress
+from ipfs.file_cache import FileCache
 from smart_contract.contracts_db import SmartContractDatabase
-from smart_contract.secure_executor import SecureContractExecutor
+from smart_contract.secure_executor import SecureContractExecutor, warm_sandbox_pool
+from smart_contract.state_diff import invoke_payload, invoke_post_state, invoke_state_matches
+from smart_contract.state_codec import state_hash
+from smart_contract.scheduler import run_grouped
 from storage.storage_manager import save_key, load_key, save_chain, load_chain, save_peers, load_peers
 from ecdsa import VerifyingKey
 from pathlib import Path
@@ -70,6 +75,8 @@ class Peer:
         self.repo_path = Path.home() / f".ipfs_{port}"
         self.env = os.environ.copy()
         self.env["IPFS_PATH"] = str(self.repo_path)
+        self.ipfs = IpfsClient(self.ipfs_port)
+        self.file_cache = FileCache(Path.home() / f".ipfs_cache_{port}")
 
         self.server_connections :Set[websockets.WebSocketServerProtocol]=set() # For inbound peers ie websockets that connect to us and treat us as the server
         self.client_connections :Set[websockets.WebSocketServerProtocol]=set() # For outbound peers ie websockets we initiated, we are the clients
@@ -111,7 +118,7 @@ class Peer:
 
         self.file_hashes: Dict[str, str]={}
         self.file_hashes_lock= asyncio.Lock()
-        self.daemon_process=None
+        self.ipfs_daemon=IpfsDaemon(self.repo_path, self.ipfs, self.ipfs_port, self.gateway_port, self.swarm_tcp, self.swarm_udp)
 
         self.name_to_public_key_dict: Dict[str, str]={}
         
@@ -130,6 +137,7 @@ class Peer:
             self.chain = None
 
         self.contractsDB = SmartContractDatabase()
+        warm_sandbox_pool() # the workers start in the background
 
         self.mem_pool_condition=asyncio.Condition() 
         """
@@ -166,7 +174,7 @@ class Peer:
         self.chain=Chain(blockList=block_list)
 
     def save_chain_to_disk(self):
-        chain = Chain.instance.to_block_dict_list()
+        chain = Chain.instance.to_block_dict_list(with_files=True)
         save_chain(chain, CONSENSUS)
 
     def save_known_peers_to_disk(self):
@@ -243,7 +251,10 @@ class Peer:
 
         
         newBlock=Block(new_block_prevHash, transactions, new_block_ts, new_block_nonce, new_block_id)   
-        newBlock.files=block_dict["files"]
+        newBlock.files_root=block_dict.get("files_root")
+        files=block_dict.get("files", {})
+        # A list that doesn't match the root is dropped, it's fetched again from another node
+        newBlock.files=files if newBlock.files_match_root(files) else {}
 
         return newBlock
 
@@ -255,22 +266,46 @@ class Peer:
             return False
         return True
 
-    def valid_invoke_transaction(self, payload):
+    async def valid_invoke_transaction(self, payload, pre_state=None, pre_hash=None):
         contract_id = payload[0]
         func_name = payload[1]
         args = payload[2]
-        response = self.run_contract([contract_id, func_name, args])
+        if pre_state is None:
+            pre_state = self.get_contract_state(contract_id)
+            pre_hash = Chain.instance.contract_state_hash(contract_id)
+        response = await self.run_contract([contract_id, func_name, args], pre_state)
         if(response["error"] != None):
             return False
-        state = response["state"]
         gas_used = response["gas_used"]
         amount = gas_used * GAS_PRICE
-        if state != payload[3]:
+        if not invoke_state_matches(payload, pre_state, pre_hash, response["state_hash"]):
             return False
         if amount != payload[-1]:
             return False
         return True
 
+    async def valid_invoke_transactions(self, transactions):
+        """
+            Validates the invoke transactions of a block. Calls to the same
+            contract run in block order, calls to different contracts run
+            concurrently on the sandbox pool. The first call to a contract is
+            checked against its state at our tip, every later one against
+            the state the call before it left
+        """
+        payloads = [transaction.payload for transaction in transactions if transaction.receiver == "invoke"]
+        running_states = {payload[0]: (self.get_contract_state(payload[0]), Chain.instance.contract_state_hash(payload[0])) for payload in payloads}
+
+        async def valid_in_block(payload):
+            pre_state, pre_hash = running_states[payload[0]]
+            if not await self.valid_invoke_transaction(payload, pre_state, pre_hash):
+                return False
+            post_state = invoke_post_state(payload, pre_state)
+            running_states[payload[0]] = (post_state, state_hash(post_state))
+            return True
+
+        results = await run_grouped(payloads, lambda payload: payload[0], valid_in_block)
+        return all(results)
+
     def get_unique_name(self, base_name):
         existing_names = []
         for key, value in self.known_peers.items():
@@ -416,6 +451,15 @@ class Peer:
 
             await self.broadcast_message(msg)
 
+        elif t=="files":
+            files=msg.get("files")
+            if not isinstance(files, dict):
+                return
+            async with self.file_hashes_lock:
+                self.file_hashes.update(files)
+
+            await self.broadcast_message(msg)
+
         elif t=="new_tx":
             tx_str=msg["transaction"]
             tx=json.loads(tx_str)
@@ -432,7 +476,7 @@ class Peer:
                 if not self.valid_deploy_transaction(transaction.payload):
                     return
             if transaction.receiver == "invoke":
-                if not self.valid_invoke_transaction(transaction.payload):
+                if not await self.valid_invoke_transaction(transaction.payload):
                     return
 
             amount = 0
@@ -474,12 +518,15 @@ class Peer:
                 return
             
             for transaction in newBlock.transactions:
-                if transaction.receiver == "invoke":
-                    if not self.valid_invoke_transaction(transaction.payload):
-                        return
                 if transaction.receiver == "deploy":
                     if not self.valid_deploy_transaction(transaction.payload):
                         return
+            if not await self.valid_invoke_transactions(newBlock.transactions):
+                return
+            # Other messages are handled while the contracts run
+            if newBlock.prevHash != Chain.instance.lastBlock.hash:
+                print("\nInvalid Block (chain moved on while validating it)\n")
+                return
 
             newBlock.miner=msg["miner"]
             Chain.instance.chain.append(newBlock)
@@ -635,11 +682,7 @@ class Peer:
         await self.broadcast_message(pkt)
 
     def get_contract_state(self, contract_id):
-        for block in reversed(Chain.instance.chain):
-            for transaction in reversed(block.transactions):
-                if transaction.receiver == "invoke" and transaction.payload[0] == contract_id:
-                    return transaction.payload[3]
-        return {}
+        return Chain.instance.contract_state(contract_id)
 
     async def user_input_handler(self):
         """
@@ -701,7 +744,10 @@ class Peer:
                         args.append(parsed_arg)
                         arg_number += 1
 
-                    response = self.run_contract([contract_id, func_name, args])
+                    # The diff goes against the state the call ran on, the
+                    # contract can move on while we wait for the sandbox
+                    pre_state = self.get_contract_state(contract_id)
+                    response = await self.run_contract([contract_id, func_name, args], pre_state)
                     if(response["error"] != None):
                         print("Error: ", response["error"])
                         continue
@@ -709,7 +755,7 @@ class Peer:
                     gas_used = response["gas_used"]
                     amount = gas_used * GAS_PRICE
 
-                    payload = [contract_id, func_name, args, state, amount]
+                    payload = invoke_payload(contract_id, func_name, args, pre_state, state, amount)
 
                     if amount<=Chain.instance.calc_balance(self.wallet.public_key, self.mem_pool):
                         await self.create_and_broadcast_tx(rec, payload)
@@ -766,9 +812,12 @@ class Peer:
                     None, input, "\nEnter description of file: "
                 )
                 path= await asyncio._get_running_loop().run_in_executor(
-                    None, input, "\nEnter path of file: "
+                    None, input, "\nEnter path of file or folder: "
                 )
-                pkt=await self.uploadFile(desc, path)
+                if Path(path).is_dir():
+                    pkt=await self.uploadDirectory(desc, path, print_progress(f"Uploading {path}"))
+                else:
+                    pkt=await self.uploadFile(desc, path, print_progress(f"Uploading {path}"))
                 await self.broadcast_message(pkt)
 
             elif ch==6:
@@ -778,22 +827,22 @@ class Peer:
                 path= await asyncio._get_running_loop().run_in_executor(
                     None, input, "\nEnter path to download the file: "
                 )
-                download_ipfs_file_subprocess(cid, path)
+                await self.downloadFile(cid, path, print_progress(f"Downloading {cid}"))
 
             elif ch==7:
                 print("Quitting...")
                 break
 
-    async def uploadFile(self, desc: str, path:str):
+    async def uploadFile(self, desc: str, path:str, progress=None):
         file_path=Path(path)
         if(not file_path.is_file()):
             print("\nFile doesn't exist\n")
             return
 
-        if not self.daemon_process: 
-            self.start_daemon()
+        if not await self.ensure_daemon():
+            return
         
-        cid, name = await asyncio.to_thread(addToIpfs, path)
+        cid, name = await self.ipfs.add_async(path, progress)
         if(not(cid and name)):
             return
         
@@ -810,31 +859,109 @@ class Peer:
             self.file_hashes[cid]=desc
         return pkt
 
-    def init_repo(self):
+    async def uploadFiles(self, files, progress=None):
         """
-            Creates a ipfs repo of name ending in ipfs_port_no eg ipfs_5000 
+            Uploads [(desc, path), ...] several at a time and announces all
+            the CIDs in a single "files" packet, which is returned like the
+            "file" packet of uploadFile. None if no file got added
         """
-        if not self.repo_path.exists():
-            subprocess.run(["ipfs", "init"], env=self.env, check=True)
-            print("\nIPFS repo created\n")
-
-    def configure_ports(self):
-        subprocess.run(["ipfs", "config", "Addresses.API", f"/ip4/127.0.0.1/tcp/{self.ipfs_port}"], env=self.env, check=True)
-        subprocess.run(["ipfs", "config", "Addresses.Gateway", f"/ip4/127.0.0.1/tcp/{self.gateway_port}"], env=self.env, check=True)
-        subprocess.run([
-            "ipfs", "config", "Addresses.Swarm", "--json",
-            f'["/ip4/127.0.0.1/tcp/{self.swarm_tcp}", "/ip4/127.0.0.1/udp/{self.swarm_udp}/quic"]'
-        ], env=self.env, check=True)
-        print("\nConfigured Ports\n")
+        found=[]
+        for desc, path in files:
+            if Path(path).is_file():
+                found.append((desc, path))
+            else:
+                print(f"\nFile {path} doesn't exist\n")
+        if not found:
+            return
+
+        if not await self.ensure_daemon():
+            return
+
+        results=await self.ipfs.add_many_async([path for _, path in found], progress)
+        added={}
+        failed=0
+        for (desc, path), (cid, name) in zip(found, results):
+            if cid and name:
+                added[cid]=desc
+            else:
+                failed+=1
+        print(f"\n{len(added)} New Files Created, {failed} failed\n")
+        if not added:
+            return
+
+        pkt={
+            "type":"files",
+            "id":str(uuid.uuid4()),
+            "files":added
+        }
+
+        self.seen_message_ids.add(pkt["id"])
+        async with self.file_hashes_lock:
+            self.file_hashes.update(added)
+        return pkt
+
+    async def uploadDirectory(self, desc: str, path: str, progress=None):
+        """
+            Uploads every file under the folder at path, each one described
+            by desc followed by its path inside the folder
+        """
+        dir_path=Path(path)
+        if(not dir_path.is_dir()):
+            print("\nFolder doesn't exist\n")
+            return
+
+        files=[]
+        for file_path in sorted(dir_path.rglob("*")):
+            if file_path.is_file():
+                relative=file_path.relative_to(dir_path).as_posix()
+                files.append((f"{desc}/{relative}" if desc else relative, str(file_path)))
+        return await self.uploadFiles(files, progress)
+
+    async def downloadFile(self, cid: str, path: str, progress=None):
+        if await asyncio.to_thread(self.file_cache.copy_to, cid, path):
+            print(f"\nServed {cid} from the file cache\n")
+            return True
+
+        if not await self.ensure_daemon():
+            return False
+        if not await self.ipfs.download_async(cid, path, progress):
+            return False
+        await asyncio.to_thread(self.file_cache.insert, cid, path)
+        return True
+
+    async def streamFile(self, cid: str):
+        """
+            Opens the file for reading in chunks, returns (chunks, size) or (None, None)
+        """
+        chunks, size = self.file_cache.open(cid)
+        if chunks is not None:
+            return chunks, size
+
+        if not await self.ensure_daemon():
+            return None, None
+        chunks, size = await self.ipfs.stream_async(cid)
+        if chunks is None:
+            return None, None
+        return self.file_cache.tee(cid, chunks), size
+
+    async def ensure_daemon(self):
+        """
+            Waits until the ipfs daemon answers, starts it if the node didn't already
+        """
+        if not await self.ipfs_daemon.wait_ready():
+            print("\nIPFS daemon didn't come up\n")
+            return False
+        return True
 
     def start_daemon(self):
-        self.daemon_process= subprocess.Popen(["ipfs", "daemon"], env=self.env)
-        print("\nIPFS Daemon Started\n")
+        """
+            Brings the ipfs daemon up in the background, creating the repo ~/.ipfs_<port> on first use
+        """
+        self.ipfs_daemon.start()
 
     def stop_daemon(self):
-        if self.daemon_process:
-            self.daemon_process.terminate()
-            self.daemon_process.wait()
+        self.ipfs_daemon.stop()
+        self.ipfs.close()
 
     async def connect_to_peer(self, host, port):
         """
@@ -965,6 +1092,7 @@ class Peer:
                         continue
                     else:
                         transaction_list.append(transaction)
+                transaction_list=Chain.instance.mineable_transactions(transaction_list)
 
                 if(len(transaction_list)<=0 or len(self.name_to_public_key_dict)<=1):
                     continue
@@ -993,8 +1121,8 @@ class Peer:
                 transaction_list.append(transaction2)
                 newBlock2=Block(Chain.instance.lastBlock.hash, transaction_list)
 
-                newBlock1.files=self.file_hashes.copy()
-                newBlock2.files=self.file_hashes.copy()
+                newBlock1.anchor_files(self.file_hashes.copy())
+                newBlock2.anchor_files(self.file_hashes.copy())
 
                 await asyncio.to_thread(Chain.instance.mine, newBlock1)
                 await asyncio.to_thread(Chain.instance.mine, newBlock2)
@@ -1021,13 +1149,13 @@ class Peer:
                 pkt1={
                     "type":"new_block",
                     "id":str(uuid.uuid4()),
-                    "block":newBlock1.to_dict(),
+                    "block":newBlock1.to_dict(with_files=True),
                     "miner":self.wallet.public_key
                 }
                 pkt2={
                     "type":"new_block",
                     "id":str(uuid.uuid4()),
-                    "block":newBlock1.to_dict(),
+                    "block":newBlock1.to_dict(with_files=True),
                     "miner":self.wallet.public_key
                 }
 
@@ -1087,15 +1215,16 @@ class Peer:
         self.contractsDB.store_contract(contract_id, code)
         print("Contract deployed with id: ", contract_id)
 
-    def run_contract(self, payload):
+    async def run_contract(self, payload, state=None):
         contract_id, func_name, args = payload[0], payload[1], payload[2]
         code = self.contractsDB.get_contract(contract_id)
         if code is None:
             raise Exception(f"Contract '{contract_id}' not found.")
 
-        state = self.get_contract_state(contract_id)
-        executor = SecureContractExecutor(code)
-        response = executor.run(func_name, args, state)
+        if state is None:
+            state = self.get_contract_state(contract_id)
+        executor = SecureContractExecutor(code, self.contractsDB.get_compiled(contract_id))
+        response = await executor.run_async(func_name, args, state)
 
         return response
 
@@ -1135,8 +1264,7 @@ class Peer:
         if self.miner:
             self.mine_task=asyncio.create_task(self.mine_blocks())
 
-        self.init_repo()
-        self.configure_ports()
+        self.start_daemon()
 
         await inp_task
 
@@ -1144,8 +1272,7 @@ class Peer:
         consensus_task.cancel()
         sampler_task.cancel()
 
-        if self.daemon_process:
-            self.stop_daemon()
+        self.stop_daemon()
 
         if self.miner:
             self.mine_task.cancel()
\ No newline at end of file
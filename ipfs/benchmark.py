@@ -0,0 +1,207 @@
+"""
+IPFS transfer benchmark against the stub daemon.
+
+    python -m ipfs.benchmark [--repeat N] [--large-mb MB] [--output report.json]
+
+Starts ipfs.stub_daemon in its own process and moves small and large files
+through every way a node has to reach IPFS: an ipfs command per operation
+(the subprocess path the nodes used before the HTTP client, played by the
+stub's command line), the HTTP API client and the on-disk file cache. Also
+times a batch of small files through add_many. Prints a JSON report with
+latency and throughput per path and size, so runs before and after a change
+can be compared. The stub hashes everything like 'ipfs add' would, what is
+measured is the client side and the transport, not the daemon's datastore
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from ipfs.file_cache import FileCache
+from ipfs.ipfs_client import CHUNK_SIZE, POOL_SIZE, UPLOAD_WORKERS, IpfsClient
+
+SMALL_SIZE = 4 * 1024
+LARGE_MB = 64
+BATCH_FILES = 200
+START_TIMEOUT = 10.0
+
+def measure(fn, repeat):
+    """
+    Median and fastest wall time of fn in milliseconds and its last result
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), min(times), result
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while data := f.read(CHUNK_SIZE):
+            digest.update(data)
+    return digest.hexdigest()
+
+def write_random_file(path, size):
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            data = os.urandom(min(CHUNK_SIZE, remaining))
+            f.write(data)
+            remaining -= len(data)
+
+def stub_command(port, *args):
+    return [sys.executable, "-m", "ipfs.stub_daemon", "--api", str(port), *args]
+
+def start_stub(port, store_dir):
+    process = subprocess.Popen(stub_command(port, "daemon", "--store", store_dir), stdout=subprocess.DEVNULL)
+    client = IpfsClient(port)
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline and process.poll() is None:
+        if client.is_ready():
+            client.close()
+            return process
+        time.sleep(0.05)
+    client.close()
+    process.kill()
+    raise RuntimeError("stub daemon didn't start")
+
+def subprocess_add(port, path):
+    result = subprocess.run(stub_command(port, "add", path), capture_output=True, text=True, check=True)
+    return result.stdout.split()[1]
+
+def subprocess_get(port, cid, destination_path):
+    subprocess.run(stub_command(port, "get", cid, "-o", destination_path), capture_output=True, check=True)
+    return True
+
+def bench_path(name, add, download, path, size, destination_path, repeat):
+    """
+    Times add and download of the file at path, download has to give back
+    the same bytes. add is None for paths that only serve files
+    """
+    result = {"size": size}
+    cid = None
+    if add:
+        result["add_ms"], result["add_min_ms"], cid = measure(lambda: add(path), repeat)
+        result["add_mb_s"] = size / 1024 ** 2 / (result["add_ms"] / 1000)
+    result["download_ms"], result["download_min_ms"], ok = measure(lambda: download(cid, destination_path), repeat)
+    result["download_mb_s"] = size / 1024 ** 2 / (result["download_ms"] / 1000)
+    if not ok or file_digest(destination_path) != file_digest(path):
+        raise RuntimeError(f"{name} returned a different file")
+    os.remove(destination_path)
+    return result, cid
+
+def bench_file(port, client, cache, path, size, work_dir, repeat):
+    destination_path = os.path.join(work_dir, "downloaded")
+    paths = {}
+    paths["subprocess"], cid = bench_path(
+        "subprocess", lambda p: subprocess_add(port, p), lambda c, d: subprocess_get(port, c, d),
+        path, size, destination_path, repeat
+    )
+    paths["http"], http_cid = bench_path("http", lambda p: client.add(p)[0], client.download, path, size, destination_path, repeat)
+    if http_cid != cid:
+        raise RuntimeError("the subprocess and http paths added the file under different CIDs")
+
+    # A node caches a file on its first download and serves every later one
+    # from disk, here it goes into the cache directly
+    if not cache.insert(cid, path):
+        raise RuntimeError("the stub's CID doesn't match the cache's")
+    paths["cached"], _ = bench_path("cached", None, lambda _, d: cache.copy_to(cid, d), path, size, destination_path, repeat)
+    return paths
+
+def bench_batch(client, work_dir, count):
+    """
+    count small files through add one at a time and through add_many
+    """
+    batch_dir = os.path.join(work_dir, "batch")
+    os.makedirs(batch_dir)
+    paths = []
+    for i in range(count):
+        path = os.path.join(batch_dir, f"file{i}")
+        write_random_file(path, SMALL_SIZE)
+        paths.append(path)
+
+    start = time.perf_counter()
+    sequential = [client.add(path) for path in paths]
+    sequential_s = time.perf_counter() - start
+    start = time.perf_counter()
+    parallel = client.add_many(paths)
+    parallel_s = time.perf_counter() - start
+    if sequential != parallel:
+        raise RuntimeError("add_many returned other CIDs than add")
+    return {
+        "files": count,
+        "sequential_files_s": count / sequential_s,
+        "add_many_files_s": count / parallel_s,
+        "speedup": sequential_s / parallel_s,
+    }
+
+def run_benchmarks(repeat=10, large_repeat=3, large_mb=LARGE_MB, batch_files=BATCH_FILES):
+    work_dir = tempfile.mkdtemp(prefix="ipfs_benchmark_")
+    port = free_port()
+    process = start_stub(port, os.path.join(work_dir, "store"))
+    client = IpfsClient(port)
+    cache = FileCache(os.path.join(work_dir, "cache"), max_bytes=4 * large_mb * 1024 ** 2)
+    try:
+        files = {}
+        for name, size, runs in (("small", SMALL_SIZE, repeat), ("large", large_mb * 1024 ** 2, large_repeat)):
+            path = os.path.join(work_dir, name)
+            write_random_file(path, size)
+            files[name] = bench_file(port, client, cache, path, size, work_dir, runs)
+        batch = bench_batch(client, work_dir, batch_files)
+    finally:
+        client.close()
+        process.terminate()
+        process.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "chunk_size": CHUNK_SIZE,
+            "pool_size": POOL_SIZE,
+            "upload_workers": UPLOAD_WORKERS,
+            "repeat": repeat,
+            "large_repeat": large_repeat,
+        },
+        "files": files,
+        "batch": batch,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="IPFS transfer benchmark against the stub daemon")
+    parser.add_argument("--repeat", type=int, default=10, help="timed runs per small file measurement")
+    parser.add_argument("--large-repeat", type=int, default=3, help="timed runs per large file measurement")
+    parser.add_argument("--large-mb", type=int, default=LARGE_MB, help="size of the large file in MiB")
+    parser.add_argument("--batch-files", type=int, default=BATCH_FILES, help="small files in the add_many batch")
+    parser.add_argument("--output", help="also write the report to this file")
+    options = parser.parse_args()
+
+    # What the client prints along the way goes to stderr, stdout is only the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_benchmarks(options.repeat, options.large_repeat, options.large_mb, options.batch_files)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import hashlib
+import base58
+
+# What 'ipfs add' does without options: CIDv0, sha2-256, 256 KiB chunks,
+# leaves wrapped in dag-pb and a balanced tree of at most 174 links a node
+CHUNK_SIZE = 256 * 1024
+MAX_LINKS = 174
+UNIXFS_FILE = 2
+
+def varint(n):
+    out = bytearray()
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+def pb_bytes(field, data):
+    return varint(field << 3 | 2) + varint(len(data)) + data
+
+def pb_varint(field, n):
+    return varint(field << 3) + varint(n)
+
+def multihash(block):
+    return b"\x12\x20" + hashlib.sha256(block).digest()
+
+def leaf_block(chunk):
+    unixfs = pb_varint(1, UNIXFS_FILE)
+    if chunk:
+        unixfs += pb_bytes(2, chunk)
+    unixfs += pb_varint(3, len(chunk))
+    return pb_bytes(1, unixfs)
+
+def node_block(children):
+    """
+    dag-pb node over children given as (multihash, tsize, filesize), links
+    come before the data in the canonical encoding
+    """
+    links = b"".join(pb_bytes(2, pb_bytes(1, mh) + pb_bytes(2, b"") + pb_varint(3, tsize)) for mh, tsize, _ in children)
+    unixfs = pb_varint(1, UNIXFS_FILE) + pb_varint(3, sum(size for _, _, size in children))
+    unixfs += b"".join(pb_varint(4, size) for _, _, size in children)
+    return links + pb_bytes(1, unixfs)
+
+class CidBuilder:
+    """
+    Computes the CID 'ipfs add' would give a file, from its content fed in
+    pieces of any size. Only the leaf hashes are kept, not the content
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.leaves = []  # (multihash, tsize, filesize) of every chunk
+
+    def update(self, data):
+        self.buffer += data
+        while len(self.buffer) >= CHUNK_SIZE:
+            self.add_leaf(bytes(self.buffer[:CHUNK_SIZE]))
+            del self.buffer[:CHUNK_SIZE]
+
+    def add_leaf(self, chunk):
+        block = leaf_block(chunk)
+        self.leaves.append((multihash(block), len(block), len(chunk)))
+
+    def cid(self):
+        if self.buffer or not self.leaves:
+            self.add_leaf(bytes(self.buffer))
+            self.buffer.clear()
+
+        # A single chunk is the whole file, otherwise nodes are stacked until one is left
+        level = self.leaves
+        while len(level) > 1:
+            parents = []
+            for i in range(0, len(level), MAX_LINKS):
+                children = level[i:i + MAX_LINKS]
+                block = node_block(children)
+                tsize = len(block) + sum(tsize for _, tsize, _ in children)
+                parents.append((multihash(block), tsize, sum(size for _, _, size in children)))
+            level = parents
+        return base58.b58encode(level[0][0]).decode()
+
+def file_cid(file_path, read_size=1024 * 1024):
+    builder = CidBuilder()
+    with open(file_path, "rb") as f:
+        while True:
+            data = f.read(read_size)
+            if not data:
+                break
+            builder.update(data)
+    return builder.cid()
@@ -0,0 +1,365 @@
+"""
+Stand-in for the ipfs daemon and command line, for benchmarks and tests on
+machines without ipfs.
+
+    python -m ipfs.stub_daemon [--api PORT] daemon [--store DIR]
+    python -m ipfs.stub_daemon [--api PORT] add FILE
+    python -m ipfs.stub_daemon [--api PORT] get CID -o PATH
+    python -m ipfs.stub_daemon [--api PORT] cat CID
+
+The daemon serves the part of the HTTP API the nodes use (add, cat, get, id,
+version) and keeps every file in a directory under the CID 'ipfs add' would
+give it, computed with ipfs.cid. The commands talk to it over the API like
+the real ipfs command line does. Without --api the port comes from the
+config of the repo at $IPFS_PATH, so a script that runs this module can
+stand in for the ipfs binary through IPFS_BINARY. One file per add request
+and no directories
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+import requests
+from ipfs.cid import CidBuilder
+from ipfs.ipfs_client import API_HOST, CHUNK_SIZE, IpfsClient
+
+DEFAULT_API_PORT = 5001
+STUB_ID = "stub"
+
+def multipart_content(chunks, boundary):
+    """
+    Content of the first part of a multipart/form-data body read as chunks,
+    yielded as it arrives without holding the body in memory
+    """
+    delimiter = b"\r\n--" + boundary
+    buffer = b""
+    started = False
+    for chunk in chunks:
+        buffer += chunk
+        if not started:
+            end = buffer.find(b"\r\n\r\n")
+            if end < 0:
+                continue
+            buffer = buffer[end + 4:]
+            started = True
+        found = buffer.find(delimiter)
+        if found >= 0:
+            yield buffer[:found]
+            return
+        # Whatever could still be the start of the delimiter stays in the buffer
+        keep = len(delimiter) - 1
+        if len(buffer) > keep:
+            yield buffer[:-keep]
+            buffer = buffer[-keep:]
+    raise ValueError("multipart body ended before its closing boundary")
+
+class BlockStore:
+    """
+    Files on disk named by their CID
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = str(store_dir)
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def path(self, cid):
+        # A CID never contains a separator, anything else is not a file of ours
+        if not cid or os.sep in cid or cid.startswith("."):
+            return None
+        path = os.path.join(self.store_dir, cid)
+        return path if os.path.isfile(path) else None
+
+    def add(self, chunks):
+        """
+        Stores the content and returns (cid, size)
+        """
+        builder = CidBuilder()
+        size = 0
+        tmp_path = os.path.join(self.store_dir, f".{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                for data in chunks:
+                    f.write(data)
+                    builder.update(data)
+                    size += len(data)
+            cid = builder.cid()
+            os.replace(tmp_path, os.path.join(self.store_dir, cid))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return cid, size
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True # small responses would otherwise wait on delayed ACKs
+    store: BlockStore = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def body_chunks(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if size == 0:
+                    # Trailers end with an empty line
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    return
+                yield self.rfile.read(size)
+                self.rfile.readline()
+        else:
+            remaining = int(self.headers.get("Content-Length") or 0)
+            while remaining > 0:
+                data = self.rfile.read(min(CHUNK_SIZE, remaining))
+                if not data:
+                    return
+                remaining -= len(data)
+                yield data
+
+    def send_json(self, obj, status=200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_message(self, message, status=500):
+        # Same shape as the errors of the real API
+        self.send_json({"Message": message, "Code": 0, "Type": "error"}, status)
+
+    def start_chunked(self, content_type, size=None):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        if size is not None:
+            self.send_header("X-Content-Length", str(size))
+        self.end_headers()
+
+    def write_chunk(self, data):
+        if data:
+            self.wfile.write(b"%x\r\n" % len(data) + data + b"\r\n")
+
+    def end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        command = url.path.removeprefix("/api/v0/")
+        params = parse_qs(url.query)
+        handler = getattr(self, f"command_{command}", None) if url.path.startswith("/api/v0/") else None
+        if handler is None:
+            for _ in self.body_chunks():
+                pass
+            self.send_error_message(f"unknown command {command}", 404)
+            return
+        handler(params)
+
+    def command_add(self, params):
+        content_type = self.headers.get("Content-Type", "")
+        if "boundary=" not in content_type:
+            for _ in self.body_chunks():
+                pass
+            self.send_error_message("add expects a multipart/form-data body", 400)
+            return
+        boundary = content_type.split("boundary=", 1)[1].strip('"').encode()
+        chunks = self.body_chunks()
+        try:
+            cid, size = self.store.add(multipart_content(chunks, boundary))
+        except ValueError as e:
+            self.send_error_message(str(e), 400)
+            return
+        finally:
+            # The closing boundary is still unread, the connection is kept for the next request
+            for _ in chunks:
+                pass
+        self.send_json({"Name": cid, "Hash": cid, "Size": str(size)})
+
+    def stored_path(self, params):
+        for _ in self.body_chunks():
+            pass
+        cid = params.get("arg", [""])[0]
+        path = self.store.path(cid)
+        if path is None:
+            self.send_error_message(f"block {cid} not found")
+        return cid, path
+
+    def command_cat(self, params):
+        _, path = self.stored_path(params)
+        if path is None:
+            return
+        with open(path, "rb") as f:
+            self.start_chunked("text/plain", os.fstat(f.fileno()).st_size)
+            while data := f.read(CHUNK_SIZE):
+                self.write_chunk(data)
+        self.end_chunked()
+
+    def command_get(self, params):
+        """
+        The file as a tar archive with a single member named by its CID, the
+        way the real daemon sends it
+        """
+        cid, path = self.stored_path(params)
+        if path is None:
+            return
+        with open(path, "rb") as f:
+            info = tarfile.TarInfo(cid)
+            info.size = os.fstat(f.fileno()).st_size
+            self.start_chunked("application/x-tar")
+            self.write_chunk(info.tobuf(format=tarfile.USTAR_FORMAT))
+            while data := f.read(CHUNK_SIZE):
+                self.write_chunk(data)
+        padding = -info.size % tarfile.BLOCKSIZE
+        self.write_chunk(b"\0" * (padding + 2 * tarfile.BLOCKSIZE))
+        self.end_chunked()
+
+    def command_id(self, params):
+        for _ in self.body_chunks():
+            pass
+        self.send_json({"ID": STUB_ID, "AgentVersion": "ipfs-stub"})
+
+    def command_version(self, params):
+        for _ in self.body_chunks():
+            pass
+        self.send_json({"Version": "stub", "Commit": "", "Repo": "", "System": sys.platform})
+
+class StubDaemon:
+    """
+    Runs the stub API on a thread of this process, port 0 picks a free one
+    """
+
+    def __init__(self, store_dir, port=0, host=API_HOST):
+        handler = type("Handler", (StubHandler,), {"store": BlockStore(store_dir)})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread: threading.Thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread:
+            self.thread.join()
+
+def repo_api_port():
+    repo_path = os.environ.get("IPFS_PATH")
+    if not repo_path:
+        return DEFAULT_API_PORT
+    try:
+        with open(os.path.join(repo_path, "config")) as f:
+            api = json.load(f)["Addresses"]["API"]
+        return int(api.rsplit("/", 1)[1])
+    except (OSError, ValueError, KeyError, IndexError):
+        return DEFAULT_API_PORT
+
+def run_init():
+    repo_path = os.environ.get("IPFS_PATH")
+    if not repo_path:
+        print("IPFS_PATH isn't set", file=sys.stderr)
+        return 1
+    os.makedirs(repo_path, exist_ok=True)
+    config_path = os.path.join(repo_path, "config")
+    if os.path.exists(config_path):
+        print(f"ipfs repo already exists at {repo_path}", file=sys.stderr)
+        return 1
+    with open(config_path, "w") as f:
+        json.dump({"Identity": {"PeerID": STUB_ID}, "Addresses": {}}, f, indent=2)
+    print(f"initialized stub ipfs repo at {repo_path}")
+    return 0
+
+def run_daemon(port, store_dir):
+    if store_dir is None:
+        repo_path = os.environ.get("IPFS_PATH")
+        store_dir = os.path.join(repo_path, "stub_blocks") if repo_path else tempfile.mkdtemp(prefix="ipfs_stub_")
+    daemon = StubDaemon(store_dir, port)
+    print(f"API server listening on /ip4/{API_HOST}/tcp/{daemon.port}", flush=True)
+    print("Daemon is ready", flush=True)
+    try:
+        daemon.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.server.server_close()
+    return 0
+
+def run_get(client, cid, output):
+    """
+    Fetches the tar archive from get and writes its only member to output
+    """
+    try:
+        response = client.request("get", params={"arg": cid}, stream=True)
+    except requests.RequestException as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    with response, tarfile.open(fileobj=response.raw, mode="r|") as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            source = archive.extractfile(member)
+            output_dir = os.path.dirname(output)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            with open(output, "wb") as f:
+                shutil.copyfileobj(source, f, CHUNK_SIZE)
+            print(f"Saving file(s) to {output}")
+            return 0
+    print(f"Error: {cid} is not a file", file=sys.stderr)
+    return 1
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m ipfs.stub_daemon", description="Stand-in for the ipfs daemon and command line")
+    parser.add_argument("--api", type=int, help="API port, read from the config at $IPFS_PATH by default")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init", help="create a repo at $IPFS_PATH")
+    daemon_parser = commands.add_parser("daemon", help="serve the API")
+    daemon_parser.add_argument("--store", help="directory the files are kept in")
+    add_parser = commands.add_parser("add", help="add a file")
+    add_parser.add_argument("file")
+    add_parser.add_argument("--pin", default="true", help="accepted for compatibility, everything is kept")
+    get_parser = commands.add_parser("get", help="download a file")
+    get_parser.add_argument("cid")
+    get_parser.add_argument("-o", "--output", help="where to write the file, the CID by default")
+    cat_parser = commands.add_parser("cat", help="write a file to stdout")
+    cat_parser.add_argument("cid")
+    options = parser.parse_args(argv)
+
+    if options.command == "init":
+        return run_init()
+    port = options.api if options.api is not None else repo_api_port()
+    if options.command == "daemon":
+        return run_daemon(port, options.store)
+
+    client = IpfsClient(port)
+    try:
+        if options.command == "add":
+            cid, _ = client.add(options.file)
+            if cid is None:
+                return 1
+            print(f"added {cid} {os.path.basename(options.file)}")
+            return 0
+        if options.command == "get":
+            return run_get(client, options.cid, options.output or options.cid)
+        chunks, _ = client.stream(options.cid)
+        if chunks is None:
+            return 1
+        for data in chunks:
+            sys.stdout.buffer.write(data)
+        return 0
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,13 @@
+import ast
 import sys
+from RestrictedPython import RestrictingNodeTransformer
 
 GAS_LIMIT = 10000
+# "trace" counts line events with sys.settrace, "ast" charges gas through
+# counters compiled into the contract and runs faster. Gas counts, and so the
+# amount of invoke transactions, differ between the two: a network only
+# switches to "ast" when all of its nodes do
+GAS_ENGINE = "trace"
 
 class GasMeter:
     def __init__(self):
@@ -13,8 +20,102 @@ class GasMeter:
                 raise Exception("Out of gas")
         return self.tracer
 
+    def hooks(self):
+        return {}
+
     def start(self):
         sys.settrace(self.tracer)
 
     def stop(self):
-        sys.settrace(None)
\ No newline at end of file
+        sys.settrace(None)
+
+class StaticGasMeter:
+    """
+    Gas meter for contracts compiled with GasMeteringTransformer, the contract
+    itself calls charge so there is nothing to trace
+    """
+
+    def __init__(self):
+        self.gas_used = 0
+
+    def charge(self, amount):
+        self.gas_used += amount
+        if self.gas_used > GAS_LIMIT:
+            raise Exception("Out of gas")
+
+    def charge_iter(self, iterable):
+        for item in iterable:
+            self.charge(1)
+            yield item
+
+    def hooks(self):
+        return {'_gas_': self.charge, '_gas_iter_': self.charge_iter}
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+def new_gas_meter():
+    return StaticGasMeter() if GAS_ENGINE == "ast" else GasMeter()
+
+def block_cost(body):
+    """
+    Number of statements a block charges when it's entered. Statements of
+    nested if/try/with blocks are included, nested loops and definitions
+    charge for themselves and only count as one
+    """
+    cost = 0
+    for stmt in body:
+        cost += 1
+        if isinstance(stmt, (ast.For, ast.AsyncFor, ast.While, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        for field in ("body", "orelse", "finalbody"):
+            cost += block_cost(getattr(stmt, field, []))
+        for handler in getattr(stmt, "handlers", []):
+            cost += block_cost(handler.body)
+        for case in getattr(stmt, "cases", []):
+            cost += block_cost(case.body)
+    return cost
+
+def charge_statement(body):
+    stmt = ast.Expr(ast.Call(
+        func=ast.Name('_gas_', ast.Load()),
+        args=[ast.Constant(block_cost(body))],
+        keywords=[]))
+    ast.copy_location(stmt, body[0])
+    return ast.fix_missing_locations(stmt)
+
+class GasMeteringTransformer(RestrictingNodeTransformer):
+    """
+    RestrictedPython policy that also compiles gas metering into the contract:
+    function bodies and loop bodies charge their statement count when they
+    are entered and comprehensions charge one per item
+    """
+
+    def visit_FunctionDef(self, node):
+        node = super().visit_FunctionDef(node)
+        node.body.insert(0, charge_statement(node.body))
+        return node
+
+    def visit_For(self, node):
+        node = super().visit_For(node)
+        node.body.insert(0, charge_statement(node.body))
+        return node
+
+    def visit_While(self, node):
+        node = super().visit_While(node)
+        node.body.insert(0, charge_statement(node.body))
+        return node
+
+    def visit_comprehension(self, node):
+        node = super().visit_comprehension(node)
+        node.iter = ast.copy_location(ast.Call(
+            func=ast.Name('_gas_iter_', ast.Load()),
+            args=[node.iter],
+            keywords=[]), node.iter)
+        return ast.fix_missing_locations(node)
+
+def gas_policy():
+    return GasMeteringTransformer if GAS_ENGINE == "ast" else RestrictingNodeTransformer
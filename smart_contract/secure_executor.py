@@ -1,63 +1,266 @@
+import asyncio
+import collections
 import multiprocessing
+import os
+import queue
+import threading
 import time
 import psutil
-from smart_contract.sandbox_runner import sandbox_contract_runner
+from smart_contract.contracts_db import contract_code_hash
+from smart_contract.sandbox_runner import sandbox_worker_loop
+from smart_contract.state_codec import encode_state, decode_state, encoded_state_hash
 
 TIMEOUT = 20.0
 MEMORY_LIMIT_MB = 500
+POLL_INTERVAL = 0.05 # seconds between two memory checks of a busy worker
+POOL_SIZE = max(2, min(os.cpu_count() or 1, 8)) # workers, also bounds how many contracts run at once
+MAX_CALLS_PER_WORKER = 100 # a worker is replaced after this many calls
 
-class SecureContractExecutor:
-    def __init__(self, code: str):
-        self.code = code
+def failed_response(error):
+    return {
+        "success": False,
+        "error": error,
+        "state": None,
+        "state_hash": None,
+        "msg": None,
+        "gas_used": 0
+    }
 
-    def run(self, func_name: str, args, state):
-        manager = multiprocessing.Manager()
-        return_dict = manager.dict()
+class SandboxWorker:
+    """
+    A pre-forked sandbox process that runs contract calls sent over a pipe
+    """
 
-        process = multiprocessing.Process(
-            target=sandbox_contract_runner,
-            args=(self.code, func_name, args, state, return_dict)
-        )
+    def __init__(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=sandbox_worker_loop, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.proc = psutil.Process(self.process.pid)
+        self.calls = 0
 
-        process.start()
-        start_time = time.time()
-        proc = psutil.Process(process.pid)
+    def send(self, code_hash, code, compiled, func_name, args, state):
+        self.calls += 1
+        try:
+            self.conn.send((code_hash, code, compiled, func_name, args, encode_state(state)))
+            return True
+        except (BrokenPipeError, OSError):
+            return False
 
-        while process.is_alive():
-            elapsed = time.time() - start_time
+    def limit_error(self):
+        """
+        Error to fail the running call with, None while it's within its limits
+        """
+        if not self.process.is_alive():
+            return "Sandbox worker crashed"
+        try:
+            mem_usage_mb = self.proc.memory_info().rss / (1024 * 1024)
+            if mem_usage_mb > MEMORY_LIMIT_MB:
+                return f"Memory limit exceeded ({int(mem_usage_mb)} MB)"
+        except psutil.NoSuchProcess:
+            return "Sandbox worker crashed"
+        return None
 
-            if elapsed > TIMEOUT:
-                process.terminate()
-                return {
-                    "success": False,
-                    "error": "Execution timeout",
-                    "state": None,
-                    "msg": None,
-                    "gas_used": 0
-                }
+    def receive(self):
+        """
+        Reads the answer of the call, returns (response, reusable)
+        """
+        try:
+            return_dict = self.conn.recv()
+        except (EOFError, OSError):
+            return failed_response("Sandbox worker crashed"), False
 
-            try:
-                mem_usage_mb = proc.memory_info().rss / (1024 * 1024)
-                if mem_usage_mb > MEMORY_LIMIT_MB:
-                    process.terminate()
-                    return {
-                        "success": False,
-                        "error": f"Memory limit exceeded ({int(mem_usage_mb)} MB)",
-                        "state": None,
-                        "msg": None,
-                        "gas_used": 0
-                    }
-            except psutil.NoSuchProcess:
-                break
-
-            time.sleep(0.05)
-
-        process.join()
-
-        return {
+        state_data = return_dict.get("state")
+        response = {
             "success": return_dict.get("error") is None,
             "error": return_dict.get("error"),
-            "state": return_dict.get("state"),
+            "state": decode_state(state_data) if state_data is not None else None,
+            "state_hash": encoded_state_hash(state_data) if state_data is not None else None,
             "msg": return_dict.get("msg"),
             "gas_used": return_dict.get("gas_used")
         }
+        return response, self.calls < MAX_CALLS_PER_WORKER
+
+    def run(self, code_hash, code, compiled, func_name, args, state):
+        """
+        Sends one call to the worker and waits for its answer while enforcing
+        the timeout and memory limit. Returns (response, reusable)
+        """
+        if not self.send(code_hash, code, compiled, func_name, args, state):
+            return failed_response("Sandbox worker crashed"), False
+
+        start_time = time.time()
+        # poll returns as soon as the answer is there, the interval only
+        # bounds how often we look at the memory of a long running call
+        while not self.conn.poll(POLL_INTERVAL):
+            if time.time() - start_time > TIMEOUT:
+                return failed_response("Execution timeout"), False
+            error = self.limit_error()
+            if error:
+                return failed_response(error), False
+        return self.receive()
+
+    async def run_async(self, code_hash, code, compiled, func_name, args, state):
+        """
+        Same as run, but waits for the answer through the event loop, which
+        wakes us up when the pipe becomes readable. In between the limits are
+        checked every POLL_INTERVAL
+        """
+        if not self.send(code_hash, code, compiled, func_name, args, state):
+            return failed_response("Sandbox worker crashed"), False
+
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        fd = self.conn.fileno()
+        loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            deadline = loop.time() + TIMEOUT
+            while not ready.done():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return failed_response("Execution timeout"), False
+                await asyncio.wait([ready], timeout=min(POLL_INTERVAL, remaining))
+                if not ready.done():
+                    error = self.limit_error()
+                    if error:
+                        return failed_response(error), False
+        finally:
+            loop.remove_reader(fd)
+        return self.receive()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+class SandboxPool:
+    """
+    Keeps warm sandbox workers around so a contract call doesn't pay for
+    starting processes. A worker that hit a limit, crashed or served
+    MAX_CALLS_PER_WORKER calls is stopped and replaced by a fresh one
+    """
+
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self.idle: queue.Queue = queue.Queue()
+        # (loop, future) of run_async calls waiting for a worker, they are
+        # woken up on their own loop instead of parking a thread each
+        self.waiters = collections.deque()
+        self.lock = threading.Lock()
+        for _ in range(size):
+            self.idle.put(SandboxWorker())
+
+    def put(self, worker):
+        """
+        Hands worker to the first run_async call waiting for one, or puts it
+        back with the idle ones
+        """
+        with self.lock:
+            while self.waiters:
+                loop, future = self.waiters.popleft()
+                if future.done():
+                    continue
+                try:
+                    loop.call_soon_threadsafe(self.hand_over, future, worker)
+                    return
+                except RuntimeError:
+                    # The waiter's loop is closed
+                    continue
+            self.idle.put(worker)
+
+    def hand_over(self, future, worker):
+        # Runs on the waiter's loop, it may have been cancelled in the meantime
+        if future.done():
+            self.put(worker)
+        else:
+            future.set_result(worker)
+
+    def release(self, worker, reusable):
+        if reusable:
+            self.put(worker)
+        else:
+            worker.stop()
+            self.put(SandboxWorker())
+
+    def release_nowait(self, worker, reusable):
+        """
+        Same as release, but a worker that has to be replaced is replaced on
+        a thread of its own, nobody waits for the new process to start
+        """
+        if reusable:
+            self.put(worker)
+        else:
+            threading.Thread(target=self.release, args=(worker, False), daemon=True).start()
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            try:
+                return self.idle.get_nowait()
+            except queue.Empty:
+                pass
+            # Every worker is busy, put will hand us the next free one
+            future = loop.create_future()
+            self.waiters.append((loop, future))
+        return await future
+
+    def run(self, code_hash, code, compiled, func_name, args, state):
+        worker = self.idle.get()
+        try:
+            response, reusable = worker.run(code_hash, code, compiled, func_name, args, state)
+        except BaseException:
+            self.release(worker, False)
+            raise
+        self.release(worker, reusable)
+        return response
+
+    async def run_async(self, code_hash, code, compiled, func_name, args, state):
+        worker = await self.acquire_async()
+        try:
+            response, reusable = await worker.run_async(code_hash, code, compiled, func_name, args, state)
+        except BaseException:
+            # Also on cancellation, the worker may still be busy with the call
+            self.release_nowait(worker, False)
+            raise
+        self.release_nowait(worker, reusable)
+        return response
+
+    def close(self):
+        for _ in range(self.size):
+            self.idle.get().stop()
+
+sandbox_pool: SandboxPool = None
+sandbox_pool_lock = threading.Lock()
+
+def get_sandbox_pool():
+    global sandbox_pool
+    with sandbox_pool_lock:
+        if sandbox_pool is None:
+            sandbox_pool = SandboxPool()
+        return sandbox_pool
+
+def warm_sandbox_pool():
+    """
+    Starts the pool's workers on a background thread, nodes call this when
+    they start so the first contract call doesn't wait for them
+    """
+    threading.Thread(target=get_sandbox_pool, daemon=True).start()
+
+class SecureContractExecutor:
+    def __init__(self, code: str, compiled: bytes = None):
+        self.code = code
+        self.compiled = compiled # marshalled code object from SmartContractDatabase.get_compiled
+        self.code_hash = contract_code_hash(code)
+
+    def run(self, func_name: str, args, state):
+        return get_sandbox_pool().run(self.code_hash, self.code, self.compiled, func_name, args, state)
+
+    async def run_async(self, func_name: str, args, state):
+        # Starting the workers takes a while, it never happens on the loop
+        pool = sandbox_pool or await asyncio.to_thread(get_sandbox_pool)
+        return await pool.run_async(self.code_hash, self.code, self.compiled, func_name, args, state)
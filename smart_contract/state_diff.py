@@ -0,0 +1,95 @@
+from smart_contract.state_codec import encode_state, state_hash
+
+# Invoke transactions carry a diff against the contract's current state
+# instead of the whole new state. Nodes read both kinds either way
+STATE_DIFFS = True
+
+def diff_state(old, new):
+    """
+    Returns what turns old into new, as a dict with the keys that got a new
+    value in "set", the removed keys in "del" and the diffs of nested dicts
+    in "sub". Parts that would be empty are left out. Values are compared
+    by their canonical encoding, like the state hash sees them, so 1, 1.0
+    and True count as different
+    """
+    changed = {}
+    nested = {}
+    for key, value in new.items():
+        if key in old and encode_state(old[key]) == encode_state(value):
+            continue
+        if isinstance(value, dict) and isinstance(old.get(key), dict):
+            nested[key] = diff_state(old[key], value)
+        else:
+            changed[key] = value
+    removed = [key for key in old if key not in new]
+
+    diff = {}
+    if changed:
+        diff["set"] = changed
+    if removed:
+        diff["del"] = removed
+    if nested:
+        diff["sub"] = nested
+    return diff
+
+def apply_state_diff(state, diff):
+    """
+    Returns a new state with diff applied, state itself is left untouched.
+    A nested diff on a key that doesn't hold a dict starts from an empty one,
+    the value there is replaced. Raises ValueError if diff isn't shaped like
+    what diff_state returns
+    """
+    if not isinstance(diff, dict) or not isinstance(diff.get("set", {}), dict) \
+            or not isinstance(diff.get("del", []), list) or not isinstance(diff.get("sub", {}), dict):
+        raise ValueError("malformed state diff")
+    new_state = dict(state)
+    for key, value in diff.get("set", {}).items():
+        new_state[key] = value
+    for key in diff.get("del", []):
+        new_state.pop(key, None)
+    for key, sub_diff in diff.get("sub", {}).items():
+        value = new_state.get(key)
+        new_state[key] = apply_state_diff(value if isinstance(value, dict) else {}, sub_diff)
+    return new_state
+
+def is_diff_payload(payload):
+    """
+    Full state payloads are [contract id, function_name, arguments, state, amount],
+    diff payloads are [contract id, function_name, arguments, diff, [pre-state hash, post-state hash], amount]
+    """
+    return len(payload) == 6
+
+def invoke_payload(contract_id, func_name, args, pre_state, post_state, amount):
+    if not STATE_DIFFS:
+        return [contract_id, func_name, args, post_state, amount]
+    hashes = [state_hash(pre_state), state_hash(post_state)]
+    return [contract_id, func_name, args, diff_state(pre_state, post_state), hashes, amount]
+
+def invoke_post_state(payload, pre_state):
+    """
+    State of the contract after the invoke transaction with payload. A diff
+    that can't be applied leaves the state as it was, so replaying a chain
+    never stops at a bad transaction
+    """
+    if is_diff_payload(payload):
+        try:
+            return apply_state_diff(pre_state, payload[3])
+        except (TypeError, ValueError, AttributeError):
+            return pre_state
+    return payload[3]
+
+def invoke_state_matches(payload, pre_state, pre_hash, post_hash):
+    """
+    Whether payload takes the contract from pre_state to the state with
+    post_hash. States are compared by the hash of their canonical encoding
+    """
+    try:
+        if not is_diff_payload(payload):
+            return state_hash(payload[3]) == post_hash
+
+        payload_pre_hash, payload_post_hash = payload[4]
+        if payload_pre_hash != pre_hash or payload_post_hash != post_hash:
+            return False
+        return state_hash(apply_state_diff(pre_state, payload[3])) == post_hash
+    except (TypeError, ValueError, AttributeError):
+        return False
@@ -13,6 +13,8 @@ def start_peer():
     consensus = input("Enter Consensus[poa/pos/pow] (default : pow): ")
     activate_disk_load = input("Do you like to load saved data if any(y/n): ")
     activate_disk_save = input("Do you like to continuously backup data to disk(y/n): ")
+    activate_block_store = input("Do you like to keep finalized blocks in a memory mapped file instead of RAM(y/n): ")
+    activate_pruning = input("Do you like to prune old transactions and only keep balances and contract state(y/n): ")
     action = input("Enter 'create' to create a network and 'connect' to connect to a network (default: create): ")
     bootstrap_host = None
     bootstrap_port = None
@@ -28,7 +30,7 @@ def start_peer():
         elif mal_raw_input == "n":
             mal = False
         if(not mal):
-            peer = PoAPeer(host, port, name, activate_disk_load, activate_disk_save)
+            peer = PoAPeer(host, port, name, activate_disk_load, activate_disk_save, activate_block_store, activate_pruning)
         else:
             peer = PoaMalPeer(host, port, name, activate_disk_load, activate_disk_save)
         peer.name_to_node_id_dict[peer.name.lower()] = peer.node_id
@@ -49,7 +51,7 @@ def start_peer():
                 staker = True
             elif staker_raw_input == "n":
                 staker = False
-            peer = PoSPeer(host, port, name, staker, activate_disk_load, activate_disk_save)
+            peer = PoSPeer(host, port, name, staker, activate_disk_load, activate_disk_save, activate_block_store, activate_pruning)
         else:
             peer = PosMalPeer(host, port, name, True, activate_disk_load, activate_disk_save)
 
@@ -68,7 +70,7 @@ def start_peer():
                 miner = True
             elif miner_raw_input == "n":
                 miner = False
-            peer = PoWPeer(host, port, name, miner, activate_disk_load, activate_disk_save)
+            peer = PoWPeer(host, port, name, miner, activate_disk_load, activate_disk_save, activate_block_store, activate_pruning)
         else:
             peer = PowMalPeer(host, port, name, True, activate_disk_load, activate_disk_save)
 
@@ -0,0 +1,202 @@
+import json
+import mmap
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Dict
+
+BLOCK_CACHE_SIZE = 256 # decoded finalized blocks kept in memory
+
+class MappedBlockList:
+    """
+    List-like block store for Chain.chain.
+
+    Finalized blocks are appended as json lines to a file that is read through
+    mmap, only their offsets stay in memory. They are decoded back into Block
+    objects on access and the most recently used ones are kept in a small LRU.
+    The unfinalized window (everything past finalized_length) stays in memory
+    as regular Block objects, since that is where forks and new blocks land.
+
+    Indexing, slicing, len, iteration and append behave like on a list, slices
+    return plain lists of blocks. record_keys are the keys encode adds on top
+    of the dictionary a block is sent as, records() leaves them out.
+    """
+
+    def __init__(self, path: str, encode: Callable[[Any], Dict], decode: Callable[[Dict], Any],
+                 finalized_length: Callable[[int], int], cache_size=BLOCK_CACHE_SIZE, record_keys=()):
+        self.path = path
+        self.encode = encode
+        self.decode = decode
+        self.finalized_length = finalized_length
+        self.cache_size = cache_size
+        self.record_keys = record_keys
+
+        self.offsets = array('Q')
+        self.lengths = array('Q')
+        self.end = 0 # Where the next record is written
+        self.hot = []
+        self.cache: OrderedDict = OrderedDict()
+
+        # The store only backs the running chain, it's rebuilt on every start
+        self.file = open(path, 'w+b')
+        self.mm: mmap.mmap = None
+
+    def __len__(self):
+        return len(self.offsets) + len(self.hot)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("block index out of range")
+
+        if index >= len(self.offsets):
+            return self.hot[index - len(self.offsets)]
+
+        block = self.cache.get(index)
+        if block is not None:
+            self.cache.move_to_end(index)
+            return block
+
+        block = self.decode(self.read_record(index))
+        self.cache[index] = block
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return block
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __reversed__(self):
+        for i in range(len(self) - 1, -1, -1):
+            yield self[i]
+
+    def copy(self):
+        return list(self)
+
+    def records(self):
+        """
+        Every block as the dictionary it's sent as. Stored blocks are read
+        straight from the file, they don't go through decode and encode
+        """
+        records = []
+        if self.offsets:
+            if self.mm is None or self.end > len(self.mm):
+                self.remap()
+            # One parse for the whole list is a lot cheaper than one per record
+            data = b",".join(self.mm[start:start + length] for start, length in zip(self.offsets, self.lengths))
+            records = json.loads(b"[" + data + b"]")
+        records.extend(self.encode(block) for block in self.hot)
+        for record in records:
+            for key in self.record_keys:
+                record.pop(key, None)
+        return records
+
+    def read_record(self, index):
+        start = self.offsets[index]
+        stop = start + self.lengths[index]
+        if self.mm is None or stop > len(self.mm):
+            self.remap()
+        return json.loads(self.mm[start:stop])
+
+    def remap(self):
+        if self.mm is not None:
+            self.mm.close()
+        self.file.flush()
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def encode_record(self, block):
+        return json.dumps(self.encode(block), separators=(",", ":")).encode() + b"\n"
+
+    def write_record(self, block):
+        data = self.encode_record(block)
+        self.file.seek(self.end)
+        self.file.write(data)
+        offset = self.end
+        self.end += len(data)
+        return offset, len(data)
+
+    def append(self, block):
+        self.hot.append(block)
+        self.spill()
+
+    def spill(self):
+        """
+        Moves the blocks that became finalized from the hot window to the file
+        """
+        total = len(self)
+        spill_count = self.finalized_length(total) - len(self.offsets)
+        if spill_count <= 0:
+            return
+
+        for block in self.hot[:spill_count]:
+            offset, length = self.write_record(block)
+            self.offsets.append(offset)
+            self.lengths.append(length)
+        self.hot = self.hot[spill_count:]
+
+    def update(self, index):
+        """
+        Writes a stored block again after it was changed in place, e.g a PoS
+        block that got slashed or a block that got pruned. A record that got
+        shorter is overwritten where it is, a longer one is appended and the
+        old one is left as garbage
+        """
+        if index < 0 or index >= len(self.offsets):
+            return
+        data = self.encode_record(self[index])
+        if len(data) <= self.lengths[index]:
+            self.file.seek(self.offsets[index])
+            self.file.write(data)
+            self.file.flush()
+            self.lengths[index] = len(data)
+            return
+
+        offset, length = self.write_record(self[index])
+        self.offsets[index] = offset
+        self.lengths[index] = length
+
+    def truncate(self, length):
+        """
+        Drops every block from position length onwards
+        """
+        if length >= len(self.offsets):
+            del self.hot[length - len(self.offsets):]
+            return
+
+        del self.offsets[length:]
+        del self.lengths[length:]
+        self.hot = []
+        for index in [i for i in self.cache if i >= length]:
+            del self.cache[index]
+
+        self.end = max((self.offsets[i] + self.lengths[i] for i in range(length)), default=0)
+        # The mapping can't outlive the bytes we are about to cut off
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.file.truncate(self.end)
+
+    def replace(self, blocks):
+        """
+        Makes blocks the content of the store, keeping the stored prefix it
+        shares with the current content. Chains are hash linked so we only
+        have to find the highest position where both carry the same block
+        """
+        if blocks is self:
+            return
+
+        common = min(len(self), len(blocks))
+        while common > 0 and self[common - 1].hash != blocks[common - 1].hash:
+            common -= 1
+
+        self.truncate(common)
+        for block in blocks[common:]:
+            self.hot.append(block)
+        self.spill()
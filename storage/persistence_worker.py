@@ -0,0 +1,111 @@
+import asyncio
+from typing import Callable, Dict, Tuple
+
+FLUSH_INTERVAL = 5.0 # seconds between background flushes
+FLUSH_THRESHOLD = 20 # number of dirty marks that forces an early flush
+
+class PersistenceWorker:
+    """
+    Background writer for node state.
+
+    Handlers only mark a piece of state as dirty, together with a producer that
+    builds its serializable snapshot and a writer from storage_manager that puts
+    it on disk. Repeated marks of the same state are coalesced, the snapshot is
+    taken once per flush on the event loop and the file write runs in a thread.
+    """
+
+    def __init__(self, consensus, interval=FLUSH_INTERVAL, threshold=FLUSH_THRESHOLD):
+        self.consensus = consensus
+        self.interval = interval
+        self.threshold = threshold
+
+        self.dirty: Dict[str, Tuple[Callable, Callable]] = {} # name:(producer, writer)
+        self.pending_marks = 0
+
+        self.wake_event: asyncio.Event = None
+        self.flush_lock: asyncio.Lock = None
+        self.task: asyncio.Task = None
+        self.stopping = False
+
+    def start(self):
+        """
+        Starts the flush loop on the running event loop, does nothing if it is
+        already running or if there is no running loop yet
+        """
+        if self.task and not self.task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+
+        self.stopping = False
+        self.wake_event = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+        # Marks made before there was a loop, e.g urgent ones from the node's
+        # constructor, couldn't wake anything, so they go out on the first pass
+        if self.dirty:
+            self.wake_event.set()
+        self.task = loop.create_task(self.run())
+
+    def mark_dirty(self, name: str, producer: Callable, writer: Callable, urgent=False):
+        self.dirty[name] = (producer, writer)
+        self.pending_marks += 1
+
+        self.start()
+        if self.wake_event and (urgent or self.pending_marks >= self.threshold):
+            self.wake_event.set()
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wake_event.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake_event.clear()
+            await self.flush()
+
+    async def flush(self):
+        if not self.dirty:
+            return
+
+        dirty = self.dirty
+        self.dirty = {}
+        self.pending_marks = 0
+
+        # Snapshots are taken here on the loop so that the thread below
+        # never reads state that handlers are mutating
+        snapshots = []
+        for name, (producer, writer) in dirty.items():
+            try:
+                snapshots.append((name, writer, producer()))
+            except Exception as e:
+                print(f"Error while snapshotting {name}: {e}")
+
+        if self.flush_lock is None:
+            self.write_snapshots(snapshots)
+            return
+
+        async with self.flush_lock:
+            await asyncio.to_thread(self.write_snapshots, snapshots)
+
+    def write_snapshots(self, snapshots):
+        for name, writer, data in snapshots:
+            try:
+                writer(data, self.consensus)
+            except Exception as e:
+                print(f"Error while saving {name} to disk: {e}")
+
+    async def stop(self):
+        """
+        Stops the flush loop and writes out whatever is still dirty
+        """
+        if self.task:
+            # We let the loop finish its current write instead of cancelling it,
+            # otherwise an older snapshot could land on disk after a newer one
+            self.stopping = True
+            self.wake_event.set()
+            await self.task
+            self.task = None
+
+        await self.flush()
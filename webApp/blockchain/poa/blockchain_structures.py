@@ -1,17 +1,31 @@
-import json, hashlib, uuid, base64
+import json, hashlib, uuid, base64, sys
 from typing import List, Dict
 from datetime import datetime
+from blockchain.smart_contract.state_diff import invoke_post_state, is_diff_payload
+from blockchain.smart_contract.state_codec import state_hash
+from blockchain.poa.merkle import FILE_BATCHING, files_root
 from ecdsa import SigningKey, SECP256k1, VerifyingKey
 import binascii
 
 GAS_PRICE = 0.001 # coin per gas unit
+SNAPSHOT_INTERVAL = 10 # finalized blocks between two state snapshots
+PRUNE_DEPTH = 100 # finalized blocks that keep their transactions in pruning mode
+
+def intern_key(key):
+    """
+        Returns the canonical copy of a public key, so all the transactions
+        of an account share one PEM string instead of each holding its own
+    """
+    return sys.intern(key) if isinstance(key, str) else key
 
 class Transaction:
+    __slots__=("id", "payload", "sender", "receiver", "sign", "ts")
+
     def __init__(self, payload, sender: str, receiver: str, id=None, ts=None):
         self.id=id or str(uuid.uuid4())
         self.payload=payload # amount or [code, amount] or [contract id, function_name, arguments, state, amount]
-        self.sender: str=sender   # Public Key
-        self.receiver: str=receiver   # Public Key or "deploy" or "invoke"
+        self.sender: str=intern_key(sender)   # Public Key
+        self.receiver: str=intern_key(receiver)   # Public Key or "deploy" or "invoke"
         self.sign: bytes=None
         self.ts=ts or datetime.now().timestamp()
 
@@ -52,6 +66,12 @@ class Transaction:
             print(f"Invalid transaction signature: {e}")
             return False
     
+def transaction_key(transaction: Transaction):
+    """
+        What two transactions have to share to be equal
+    """
+    return (transaction.id, transaction.sender, transaction.receiver, transaction.ts)
+
 def txs_to_json_digestable_form(transactions: List[Transaction]):
     l=[]
     for i in range(len(transactions)):
@@ -62,6 +82,9 @@ def txs_to_json_digestable_form(transactions: List[Transaction]):
     return l
 
 class Block:
+    __slots__=("id", "ts", "prevHash", "transactions", "miner_node_id", "miner_public_key", "signature",
+                 "miners_list", "files", "files_root", "pruned_hash")
+
     def __init__(self, prevHash:str, transactions:List[Transaction], ts=None, id=None):
         self.id=id or str(uuid.uuid4())
         self.ts=ts or int(datetime.now().timestamp() * 1000)
@@ -72,9 +95,11 @@ class Block:
         self.signature = None # This will hold the digital signature from the miner
         self.miners_list = None # List of miner nodes
         self.files: Dict[str: str] = {}
+        self.files_root: str=None # Merkle root over files when the block anchors them in batched mode
+        self.pruned_hash: str=None # Hash of the block once its transactions are pruned
 
-    def to_dict(self):
-        return {
+    def to_dict(self, with_files=False):
+        block_dict={
             "id":self.id,
             "prevHash":self.prevHash,
             "transactions":txs_to_json_digestable_form(self.transactions),
@@ -82,17 +107,36 @@ class Block:
             "miner_node_id":self.miner_node_id,
             "miner_public_key":self.miner_public_key,
             "miners_list":self.miners_list,
-            "signature":self.signature,
-            "files":self.files
+            "signature":self.signature
         }
+        if self.files_root:
+            # Only the root goes into the hash, the list itself is sent along where it's asked for
+            block_dict["files_root"]=self.files_root
+            if with_files:
+                block_dict["files"]=self.files
+        else:
+            block_dict["files"]=self.files
+        if self.pruned_hash:
+            block_dict["pruned_hash"]=self.pruned_hash
+        return block_dict
 
     def __str__(self):
         return json.dumps(self.to_dict())
     
     @property ## Now you can access hash like this myblock.hash
     def hash(self):
+        if self.pruned_hash:
+            return self.pruned_hash
         block_str=json.dumps(self.to_dict())
         return hashlib.sha256(block_str.encode()).hexdigest()
+
+    def prune(self):
+        """
+            Drops the transactions of the block, its hash is kept so the next
+            block still links to it
+        """
+        self.pruned_hash=self.hash
+        self.transactions=[]
     
     def transaction_exists_in_block(self, transaction: Transaction):
         for i in range(len(self.transactions)):
@@ -101,10 +145,14 @@ class Block:
         return False
     
     def cid_exists_in_block(self, cid: str):
-        for file_hash in list(self.files.keys()):
-            if file_hash==cid:
-                return True
-        return False
+        return cid in self.files
+
+    def anchor_files(self, files: Dict[str, str]):
+        self.files=files
+        self.files_root=files_root(files) if FILE_BATCHING else None
+
+    def files_match_root(self, files: Dict[str, str]):
+        return self.files_root is None or files_root(files)==self.files_root
     
     def get_message_to_sign(self):
         return json.dumps({
@@ -138,11 +186,17 @@ def valid_chain_length(i):
 
     return valid_chain_len
 
-def calc_balance_block_list(block_list:List[Block], publicKey, i):
+def calc_balance_block_list(block_list:List[Block], publicKey, i, checkpoint:Dict=None):
     bal=0
     valid_chain_len=valid_chain_length(i)
 
-    for i in range(valid_chain_len):
+    start=0
+    if checkpoint:
+        # The blocks below the checkpoint may be pruned so we start from its balances
+        bal=checkpoint["balances"].get(publicKey, 0)
+        start=checkpoint["height"]
+
+    for i in range(start, valid_chain_len):
         for transaction in (block_list[i]).transactions:
             if transaction.sender==publicKey:
                 if transaction.receiver == "deploy" or transaction.receiver == "invoke":
@@ -161,8 +215,15 @@ def calc_balance_block_list(block_list:List[Block], publicKey, i):
     # transactions are added to the chain
     return bal
 
+def calculate_contract_id(sender, timestamp):
+    data = f"{sender}:{timestamp}"
+    hash_object = hashlib.sha256(data.encode('utf-8'))
+    return hash_object.hexdigest()
+
 class Chain:
     instance =None #Class Variable
+    block_store=None # MappedBlockList that holds the chain instead of a list, if set
+    prune_depth=None # Set to PRUNE_DEPTH to turn on pruning mode
 
     def __init__(self, publicKey:str=None, blockList: List[Block]=None):
         """
@@ -172,6 +233,61 @@ class Chain:
         """
         if not Chain.instance:
             Chain.instance=self
+
+            self.checkpoint_height=0
+            """
+                Balances, contract states and deployed contracts folded from
+                chain[:checkpoint_height]. calc_balance starts from here instead
+                of genesis and it is what gets written out as the node's snapshot
+            """
+            self.checkpoint_hash=None
+            self.checkpoint_balances: Dict[str, float]={}
+            self.checkpoint_contract_states: Dict[str, Dict]={}
+            self.checkpoint_contracts: Dict[str, str]={}
+            self.pruned_height=0 # chain[:pruned_height] only keep their hashes
+            self.pruned_tx_keys=set() # transaction_key of every transaction pruned from the chain
+            """
+                Latest state and code of every contract on the chain, kept up
+                to date by refresh_contract_index so a lookup doesn't have to
+                scan the blocks. None as height means it has to be rebuilt
+            """
+            self.contract_states: Dict[str, Dict]={}
+            self.contracts: Dict[str, str]={}
+            self.contract_state_hashes: Dict[str, str]={} # Filled on demand by contract_state_hash
+            self.contract_index_height=None
+            self.contract_index_hash=None
+            self.cid_heights: Dict[str, int]={}
+            """
+                Height of the first block that anchors each file CID, extended
+                with the blocks appended since the last lookup by
+                refresh_cid_index. None as height means it has to be rebuilt
+            """
+            self.cid_index_height=None
+            self.cid_index_hash=None
+            self.tx_keys=set()
+            """
+                Identity of every transaction in the chain's blocks, extended
+                with the blocks appended since the last lookup by
+                refresh_tx_index. None as height means it has to be rebuilt
+            """
+            self.tx_index_height=None
+            self.tx_index_hash=None
+            self.missing_files_heights=set()
+            """
+                Heights of the batched blocks we only have the files root of,
+                extended with the blocks appended since the last lookup by
+                refresh_missing_files_index. None as height means it has to be
+                rebuilt
+            """
+            self.missing_files_index_height=None
+            self.missing_files_index_hash=None
+            self.block_hashes: List[str]=[]
+            """
+                Hash of the block at each height, extended with the blocks
+                appended since the last lookup by refresh_block_hashes so the
+                hashes aren't computed again for every chain we check against
+                ours
+            """
             """
                 If blocklist is given we simply make that the chain otherwise
                 we create a new chain
@@ -184,6 +300,29 @@ class Chain:
             elif blockList and not publicKey:
                 self.chain=blockList.copy()
 
+    @property
+    def chain(self):
+        if Chain.block_store is not None:
+            return Chain.block_store
+        return self._chain
+
+    @chain.setter
+    def chain(self, blocks):
+        """
+            With a block store set, assigning a list of blocks replaces its
+            content instead, so the code that reassigns Chain.instance.chain
+            keeps working in both storage modes
+        """
+        if Chain.block_store is not None:
+            Chain.block_store.replace(blocks)
+        else:
+            self._chain=blocks
+        self.contract_index_height=None
+        self.cid_index_height=None
+        self.tx_index_height=None
+        self.missing_files_index_height=None
+        self.block_hashes=[]
+
     @property
     def lastBlock(self):
         return self.chain[-1]
@@ -191,34 +330,409 @@ class Chain:
     def mine(self, block:Block): # point 1
         pass
 
-    def to_block_dict_list(self):
+    def apply_block_to_balances(self, block: Block, balances: Dict[str, float]):
+        """
+            Adds the balance changes made by block to balances, in the same
+            order calc_balance applies them
+        """
+        for transaction in block.transactions:
+            if transaction.receiver == "deploy" or transaction.receiver == "invoke":
+                balances[transaction.sender]=balances.get(transaction.sender, 0)-transaction.payload[-1]
+            else:
+                balances[transaction.sender]=balances.get(transaction.sender, 0)-transaction.payload
+                if transaction.receiver!=transaction.sender:
+                    balances[transaction.receiver]=balances.get(transaction.receiver, 0)+transaction.payload
+        if block.miner_public_key:
+            balances[block.miner_public_key]=balances.get(block.miner_public_key, 0)+6 #Miner reward
+
+    def apply_block_to_contracts(self, block: Block, contract_states: Dict[str, Dict], contracts: Dict[str, str]):
+        for transaction in block.transactions:
+            if transaction.receiver == "deploy":
+                contracts[calculate_contract_id(transaction.sender, transaction.ts)]=transaction.payload[0]
+            elif transaction.receiver == "invoke":
+                contract_id=transaction.payload[0]
+                contract_states[contract_id]=invoke_post_state(transaction.payload, contract_states.get(contract_id, {}))
+
+    def block_updated(self, pos):
+        """
+            Has to be called after a block of the chain was changed in place,
+            so that the checkpoint and the block store don't keep the old one
+        """
+        if pos<self.checkpoint_height:
+            self.reset_checkpoint()
+        self.contract_index_height=None
+        self.cid_index_height=None
+        self.tx_index_height=None
+        self.missing_files_index_height=None
+        self.block_hashes=[]
+        if Chain.block_store is not None:
+            Chain.block_store.update(pos)
+
+    def reset_checkpoint(self):
+        self.checkpoint_height=0
+        self.checkpoint_hash=None
+        self.checkpoint_balances={}
+        self.checkpoint_contract_states={}
+        self.checkpoint_contracts={}
+        self.contract_index_height=None
+
+    def refresh_contract_index(self):
+        """
+            Folds the blocks appended since the last lookup into the contract
+            index. If the chain got replaced or changed below what's indexed
+            it's rebuilt from the checkpoint
+        """
+        h=self.contract_index_height
+        if h is None or h<self.checkpoint_height or h>len(self.chain) or (h>0 and self.chain[h-1].hash!=self.contract_index_hash):
+            self.contract_states=dict(self.checkpoint_contract_states)
+            self.contracts=dict(self.checkpoint_contracts)
+            self.contract_state_hashes={}
+            h=self.checkpoint_height
+
+        for block in self.chain[h:]:
+            self.apply_block_to_contracts(block, self.contract_states, self.contracts)
+            for transaction in block.transactions:
+                if transaction.receiver == "invoke":
+                    self.contract_state_hashes.pop(transaction.payload[0], None)
+        self.contract_index_height=len(self.chain)
+        self.contract_index_hash=self.chain[-1].hash if self.chain else None
+
+    def contract_state(self, contract_id):
+        self.refresh_contract_index()
+        return self.contract_states.get(contract_id, {})
+
+    def contract_state_hash(self, contract_id):
+        self.refresh_contract_index()
+        if contract_id not in self.contract_state_hashes:
+            self.contract_state_hashes[contract_id]=state_hash(self.contract_states.get(contract_id, {}))
+        return self.contract_state_hashes[contract_id]
+
+    def mineable_transactions(self, transactions):
+        """
+            transactions without the invoke calls that can't go in a block
+            in this order. Calls to one contract run one after another, a
+            diff has to be made for the state the call before it left, or
+            for our tip if it's the first. A full state payload doesn't say
+            which state it was made for, it only goes in as the first call
+        """
+        running_hashes={}
+        mineable=[]
+        for transaction in transactions:
+            if transaction.receiver=="invoke":
+                payload=transaction.payload
+                contract_id=payload[0]
+                if is_diff_payload(payload):
+                    pre_hash=running_hashes.get(contract_id) or self.contract_state_hash(contract_id)
+                    if payload[4][0]!=pre_hash:
+                        continue
+                    running_hashes[contract_id]=payload[4][1]
+                else:
+                    if contract_id in running_hashes:
+                        continue
+                    running_hashes[contract_id]=state_hash(payload[3])
+            mineable.append(transaction)
+        return mineable
+
+    def contract_code(self, contract_id):
+        self.refresh_contract_index()
+        return self.contracts.get(contract_id)
+
+    def refresh_cid_index(self):
+        """
+            Adds the files of the blocks appended since the last lookup to the
+            CID index, rebuilds it if the chain got replaced or changed below
+            what's indexed. Pruned blocks keep their files, so it always
+            covers the whole chain
+        """
+        h=self.cid_index_height
+        if h is None or h>len(self.chain) or (h>0 and self.chain[h-1].hash!=self.cid_index_hash):
+            self.cid_heights={}
+            h=0
+
+        for height, block in enumerate(self.chain[h:], h):
+            for cid in block.files:
+                self.cid_heights.setdefault(cid, height)
+        self.cid_index_height=len(self.chain)
+        self.cid_index_hash=self.chain[-1].hash if self.chain else None
+
+    def refresh_tx_index(self):
+        """
+            Same as refresh_cid_index for the transactions. Pruned blocks lose
+            theirs, a rebuild starts from the keys kept when they got pruned
+        """
+        h=self.tx_index_height
+        if h is None or h>len(self.chain) or (h>0 and self.chain[h-1].hash!=self.tx_index_hash):
+            self.tx_keys=set(self.pruned_tx_keys)
+            h=0
+
+        for block in self.chain[h:]:
+            for transaction in block.transactions:
+                self.tx_keys.add(transaction_key(transaction))
+        self.tx_index_height=len(self.chain)
+        self.tx_index_hash=self.chain[-1].hash if self.chain else None
+
+    def cid_height(self, cid: str):
+        """
+            Height of the block that anchors cid, None if no block has it
+        """
+        self.refresh_cid_index()
+        return self.cid_heights.get(cid)
+
+    def refresh_missing_files_index(self):
+        """
+            Same as refresh_cid_index for the batched blocks that still miss
+            their file list
+        """
+        h=self.missing_files_index_height
+        if h is None or h>len(self.chain) or (h>0 and self.chain[h-1].hash!=self.missing_files_index_hash):
+            self.missing_files_heights=set()
+            h=0
+
+        for height, block in enumerate(self.chain[h:], h):
+            if block.files_root and not block.files:
+                self.missing_files_heights.add(height)
+        self.missing_files_index_height=len(self.chain)
+        self.missing_files_index_hash=self.chain[-1].hash if self.chain else None
+
+    def missing_file_lists(self):
+        """
+            [height, hash] of the batched blocks we only have the files root of
+        """
+        self.refresh_missing_files_index()
+        return [[height, self.chain[height].hash] for height in sorted(self.missing_files_heights)]
+
+    def fill_block_files(self, height: int, block_hash: str, files: Dict[str, str]):
+        """
+            Stores the file list of a batched block we got without it, if it
+            matches the root the block commits to. Returns whether it was taken
+        """
+        if height<0 or height>=len(self.chain):
+            return False
+        block=self.chain[height]
+        if block.hash!=block_hash or not block.files_root or block.files or not files or not block.files_match_root(files):
+            return False
+
+        block.files=files
+        self.cid_index_height=None
+        self.missing_files_heights.discard(height)
+        # The hash didn't change, only the stored record has to be written again
+        if Chain.block_store is not None:
+            Chain.block_store.update(height)
+        return True
+
+    def refresh_block_hashes(self):
+        """
+            Adds the hashes of the blocks appended since the last lookup,
+            starts over if the chain got replaced or changed below what's
+            covered
+        """
+        h=len(self.block_hashes)
+        if h>len(self.chain) or (h>0 and self.chain[h-1].hash!=self.block_hashes[-1]):
+            self.block_hashes=[]
+            h=0
+
+        for block in self.chain[h:]:
+            self.block_hashes.append(block.hash)
+
+    def checkpoint_target(self):
+        """
+            Height the checkpoint can move up to, in pruning mode it stays
+            prune_depth blocks below the finalized point
+        """
+        return valid_chain_length(len(self.chain))-(Chain.prune_depth or 0)
+
+    def advance_checkpoint(self, height=None):
+        """
+            Folds the finalized blocks after the current checkpoint into it
+        """
+        if height is None:
+            height=self.checkpoint_target()
+        if height<=self.checkpoint_height:
+            return
+
+        for i in range(self.checkpoint_height, height):
+            block=self.chain[i]
+            self.apply_block_to_balances(block, self.checkpoint_balances)
+            self.apply_block_to_contracts(block, self.checkpoint_contract_states, self.checkpoint_contracts)
+
+        self.checkpoint_height=height
+        self.refresh_block_hashes()
+        self.checkpoint_hash=self.block_hashes[height-1]
+
+        if Chain.prune_depth is not None:
+            self.prune_below_checkpoint()
+
+    def prune_below_checkpoint(self):
+        for i in range(self.pruned_height, self.checkpoint_height):
+            block=self.chain[i]
+            for transaction in block.transactions:
+                self.pruned_tx_keys.add(transaction_key(transaction))
+            block.prune()
+            if Chain.block_store is not None:
+                Chain.block_store.update(i)
+        self.pruned_height=self.checkpoint_height
+
+    def prune(self):
+        """
+            Has to be called after the chain grew, in pruning mode it moves
+            the checkpoint up and drops the transactions below it. With a
+            block store it moves the checkpoint up as well, so calc_balance
+            doesn't have to read the stored blocks back
+        """
+        if (Chain.prune_depth is not None or Chain.block_store is not None) and self.snapshot_due():
+            self.advance_checkpoint()
+
+    def snapshot_due(self):
+        return self.checkpoint_target()-self.checkpoint_height>=SNAPSHOT_INTERVAL
+
+    def to_snapshot(self):
+        return {
+            "height":self.checkpoint_height,
+            "tip_hash":self.checkpoint_hash,
+            "balances":dict(self.checkpoint_balances),
+            "contract_states":dict(self.checkpoint_contract_states),
+            "contracts":dict(self.checkpoint_contracts),
+            "pruned_tx_keys":[list(key) for key in self.pruned_tx_keys]
+        }
+
+    def restore_checkpoint(self, snapshot: Dict):
+        """
+            Adopts snapshot as the checkpoint if it matches the stored chain,
+            i.e the block at its height has its tip hash and every stored block
+            links to the hash of the one before it. Returns whether it was adopted.
+            Every stored block is hashed, the hashes are kept for the block
+            hash index
+        """
+        height=snapshot.get("height", 0)
+        if height<=0 or height>len(self.chain):
+            return False
+        pruned=pruned_prefix_length(self.chain)
+        if pruned>height:
+            return False
+
+        block_hashes=[]
+        prev_hash=None
+        for i in range(len(self.chain)):
+            block_hash=self.chain[i].hash
+            block_hashes.append(block_hash)
+            if i>0 and self.chain[i].prevHash!=prev_hash:
+                print(f"\nStored chain is broken at block {i}\n")
+                return False
+            if i==height-1 and block_hash!=snapshot.get("tip_hash"):
+                print("\nSnapshot doesn't match the stored chain\n")
+                return False
+            prev_hash=block_hash
+
+        self.checkpoint_height=height
+        self.checkpoint_hash=snapshot["tip_hash"]
+        self.checkpoint_balances=snapshot.get("balances", {})
+        self.checkpoint_contract_states=snapshot.get("contract_states", {})
+        self.checkpoint_contracts=snapshot.get("contracts", {})
+        self.pruned_tx_keys={tuple(key) for key in snapshot.get("pruned_tx_keys", [])}
+        self.pruned_height=pruned
+        self.contract_index_height=None
+        self.tx_index_height=None
+        self.block_hashes=block_hashes
+        return True
+
+    def checkpoint_for(self, blockList: List[Block]):
+        """
+            Checkpoint to validate and adopt blockList with, built from our
+            own blocks. Pruned blocks can't be checked, so we only take the
+            ones we validated ourselves: each of them has to hash like our
+            block at its height, and the last one has to be at or below our
+            finalized point or covered by our checkpoint, which has to be on
+            blockList. Returns None if blockList has no pruned blocks or if
+            we can't vouch for them
+        """
+        pruned=pruned_prefix_length(blockList)
+        if not pruned or pruned>len(self.chain):
+            return None
+        self.refresh_block_hashes()
+        for i in range(pruned):
+            if blockList[i].hash!=self.block_hashes[i]:
+                return None
+        h=self.checkpoint_height
+        if h>=pruned:
+            if h>len(blockList) or blockList[h-1].hash!=self.checkpoint_hash:
+                return None
+            snapshot=self.to_snapshot()
+        else:
+            if pruned>valid_chain_length(len(self.chain)) or self.chain[pruned-1].hash!=blockList[pruned-1].hash:
+                return None
+            # Our blocks up to there still have their transactions, they
+            # are folded into a copy of our checkpoint
+            snapshot=self.to_snapshot()
+            for block in self.chain[h:pruned]:
+                self.apply_block_to_balances(block, snapshot["balances"])
+                self.apply_block_to_contracts(block, snapshot["contract_states"], snapshot["contracts"])
+            snapshot["height"]=pruned
+            snapshot["tip_hash"]=blockList[pruned-1].hash
+        # Everything below the pruned blocks of blockList counts as pruned once it's adopted
+        for block in self.chain[self.pruned_height:pruned]:
+            for transaction in block.transactions:
+                snapshot["pruned_tx_keys"].append(list(transaction_key(transaction)))
+        return snapshot
+
+    def to_block_dict_list(self, with_files=False):
+        """
+            Chains sent to other nodes leave out the file lists of batched
+            blocks, they are fetched separately. What goes to disk keeps them
+        """
+        if Chain.block_store is not None:
+            block_dict_list=Chain.block_store.records()
+            if not with_files:
+                for block_dict in block_dict_list:
+                    if block_dict.get("files_root"):
+                        block_dict.pop("files", None)
+            return block_dict_list
+
         block_dict_list=[]
         for block in self.chain:
-            block_dict_list.append(block.to_dict())
+            block_dict_list.append(block.to_dict(with_files))
         
         return block_dict_list
     
-    def rewrite(self, blockList :List[Block]):
+    def rewrite(self, blockList :List[Block], checkpoint: Dict=None):
+        """
+            checkpoint is what checkpoint_for built for chains that have pruned
+            blocks. Without one we can't fold blocks that lost their
+            transactions, so we refuse
+            chains that fork below our pruned history or that are pruned
+            further than our checkpoint
+        """
         if len(self.chain)>=len(blockList):
             return
+
+        if not checkpoint:
+            h=self.checkpoint_height
+            if pruned_prefix_length(blockList)>h or (self.pruned_height and blockList[h-1].hash!=self.checkpoint_hash):
+                print("\nReceived chain can't be used without the pruned history\n")
+                return
         
         Chain.instance.chain=blockList.copy()
 
+        if checkpoint and self.restore_checkpoint(checkpoint):
+            return
+
+        h=self.checkpoint_height
+        if h and (h>len(self.chain) or self.chain[h-1].hash!=self.checkpoint_hash):
+            self.reset_checkpoint()
+        self.pruned_height=pruned_prefix_length(self.chain)
+
     def cid_exists_in_chain(self, cid: str):
-        for block in reversed(self.chain):
-            if block.cid_exists_in_block(cid):
-                return True
-        
-        return False
+        return self.cid_height(cid) is not None
 
     def transaction_exists_in_chain(self, transaction: Transaction):
-        for block in reversed(self.chain):
-            if block.transaction_exists_in_block(transaction):
-                return True
-        
-        return False
+        self.refresh_tx_index()
+        return transaction_key(transaction) in self.tx_keys
                 
     def isValidBlock(self, block: Block, reqd_miner_node_id, reqd_miner_public_key):
+        if block.pruned_hash:
+            # A new block always has its transactions, only chains carry pruned blocks
+            print("\nPruned block can't be validated\n")
+            return False
+
         if block.miner_node_id != reqd_miner_node_id:
             print("Mined by malicious miner")
             return False
@@ -264,7 +778,12 @@ class Chain:
         bal=0
         valid_chain_len=valid_chain_length(len(self.chain))
 
-        for i in range(valid_chain_len):
+        start=0
+        if 0<self.checkpoint_height<=valid_chain_len:
+            bal=self.checkpoint_balances.get(publicKey, 0)
+            start=self.checkpoint_height
+
+        for i in range(start, valid_chain_len):
             for transaction in (Chain.instance.chain[i]).transactions:
                 if transaction.sender==publicKey:
                     if transaction.receiver == "deploy" or transaction.receiver == "invoke":
@@ -313,9 +832,44 @@ def transaction_exists_in_block_list(blockList:List[Block], transaction_tc:Trans
                 return False
 
 # Is valid chain function
-def isvalidChain(blockList:List[Block]):
+def pruned_prefix_length(blockList:List[Block]):
+    """
+        Number of blocks at the start of blockList whose transactions
+        were pruned
+    """
+    pruned=0
+    while pruned<len(blockList) and blockList[pruned].pruned_hash:
+        pruned+=1
+    return pruned
+
+def checkpoint_matches(blockList:List[Block], checkpoint:Dict, pruned:int):
+    """
+        Whether checkpoint covers the pruned blocks of blockList and its tip
+        hash is the one of the block at its height
+    """
+    if not checkpoint:
+        return False
+    height=checkpoint.get("height", 0)
+    return pruned<=height<=len(blockList) and blockList[height-1].hash==checkpoint.get("tip_hash")
+
+def isvalidChain(blockList:List[Block], checkpoint:Dict=None):
+    pruned=pruned_prefix_length(blockList)
+    if pruned and not checkpoint_matches(blockList, checkpoint, pruned):
+        print("\nPruned chain without a matching checkpoint\n")
+        return False
+
     for i in range(len(blockList)):
         currBlock=blockList[i]
+        if i<pruned:
+            # Pruned blocks only have their hash left, the checkpoint is built from
+            # our own blocks and vouches for them
+            if i>0 and currBlock.prevHash!=blockList[i-1].hash:
+                return False
+            continue
+        if currBlock.pruned_hash:
+            # Past the prefix the checkpoint covers, a pruned hash is only a claim
+            print("\nPruned block above the checkpoint\n")
+            return False
         
         if(not currBlock.is_valid_signature()):
             return False
@@ -338,7 +892,7 @@ def isvalidChain(blockList:List[Block]):
                 amount = transaction.payload[-1]
             else:
                 amount = transaction.payload
-            if(calc_balance_block_list(blockList, transaction.sender, i, mem_pool) < amount  or amount<=0):
+            if(calc_balance_block_list(blockList, transaction.sender, i, mem_pool, checkpoint=checkpoint) < amount  or amount<=0):
                 return False
             
             mem_pool.append(transaction)
@@ -0,0 +1,140 @@
+import asyncio, os, subprocess, time
+from blockchain.pos.ipfs import configure_addresses
+
+IPFS_BINARY = os.environ.get("IPFS_BINARY", "ipfs") # another executable can stand in for ipfs, e.g in tests
+READY_TIMEOUT = 60.0 # how long a starting daemon gets to open its API
+POLL_INTERVAL = 0.1 # between two looks at the API of a starting daemon
+HEALTH_INTERVAL = 1.0 # between two checks that the running daemon is still there
+RESTART_DELAY = 1.0 # first wait before restarting a crashed daemon, doubles up to MAX_RESTART_DELAY
+MAX_RESTART_DELAY = 30.0
+STOP_TIMEOUT = 10.0
+
+class IpfsDaemon:
+    """
+    Keeps the ipfs daemon of a node's repo running. start() brings it up in
+    the background when the node starts: the repo is created and configured
+    if needed, a daemon that already answers on the API port is reused and
+    otherwise one is spawned. Its API is polled until it's ready and it's
+    restarted whenever it exits. wait_ready() is what callers await before
+    they use the API
+    """
+
+    def __init__(self, repo_path, client, api_port, gateway_port, swarm_tcp, swarm_udp, binary=IPFS_BINARY):
+        self.repo_path = repo_path
+        self.client = client
+        self.ports = (api_port, gateway_port, swarm_tcp, swarm_udp)
+        self.binary = binary
+        self.env = os.environ.copy()
+        self.env["IPFS_PATH"] = str(repo_path)
+        self.process: subprocess.Popen = None # None while we use a daemon someone else started
+        self.ready = asyncio.Event()
+        self.task: asyncio.Task = None
+        self.stopping = False
+        self.restarts = 0
+
+    def init_repo(self):
+        """
+        Creates the repo on first use, later starts find it there
+        """
+        if not os.path.exists(os.path.join(self.repo_path, "config")):
+            subprocess.run([self.binary, "init"], env=self.env, check=True, stdout=subprocess.DEVNULL)
+            print("\nIPFS repo created\n")
+        if configure_addresses(self.repo_path, *self.ports):
+            print("\nConfigured Ports\n")
+
+    def spawn(self):
+        return subprocess.Popen([self.binary, "daemon"], env=self.env)
+
+    def wait_for_api(self, process):
+        """
+        Polls the API until it answers, gives up when process exits or
+        READY_TIMEOUT runs out
+        """
+        deadline = time.monotonic() + READY_TIMEOUT
+        while time.monotonic() < deadline and process.poll() is None:
+            if self.client.is_ready():
+                return True
+            time.sleep(POLL_INTERVAL)
+        return False
+
+    def start(self):
+        """
+        Starts supervising the daemon in the background, returns right away
+        """
+        if self.task is None or self.task.done():
+            self.stopping = False
+            self.task = asyncio.create_task(self.supervise())
+
+    async def supervise(self):
+        try:
+            await asyncio.to_thread(self.init_repo)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"\nCould not set up the IPFS repo: {e}\n")
+            return
+
+        delay = RESTART_DELAY
+        while not self.stopping:
+            if await asyncio.to_thread(self.client.is_ready):
+                # A daemon from an earlier run of this node is still up
+                print("\nUsing the IPFS daemon that is already running\n")
+                self.ready.set()
+                while not self.stopping and await asyncio.to_thread(self.client.is_ready):
+                    await asyncio.sleep(HEALTH_INTERVAL)
+                self.ready.clear()
+                continue
+
+            try:
+                self.process = self.spawn()
+            except OSError as e:
+                print(f"\nCould not start the IPFS daemon: {e}\n")
+                return
+
+            if await asyncio.to_thread(self.wait_for_api, self.process):
+                print("\nIPFS Daemon Started\n")
+                self.ready.set()
+                delay = RESTART_DELAY
+                while self.process.poll() is None:
+                    await asyncio.sleep(HEALTH_INTERVAL)
+                self.ready.clear()
+            else:
+                await asyncio.to_thread(self.kill)
+
+            if self.stopping:
+                break
+            self.restarts += 1
+            print(f"\nIPFS daemon exited with code {self.process.returncode}, restarting in {delay:g}s\n")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+
+    async def wait_ready(self, timeout=READY_TIMEOUT):
+        """
+        Whether the API answers within timeout, starts the daemon if nobody did
+        """
+        self.start()
+        if self.ready.is_set():
+            return True
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def kill(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    def stop(self):
+        """
+        Stops supervising and stops the daemon if we started it, a reused
+        one is left running
+        """
+        self.stopping = True
+        if self.task:
+            self.task.cancel()
+        self.kill()
+        self.ready.clear()
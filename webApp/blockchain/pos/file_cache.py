@@ -0,0 +1,186 @@
+import os, shutil, threading, uuid
+from collections import OrderedDict
+from blockchain.pos.cid import CidBuilder, file_cid
+
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+READ_SIZE = 1024 * 1024
+
+class FileCache:
+    """
+    Content addressed cache of IPFS files on disk, every file is stored
+    under its CID. A file only gets in after its content was hashed back to
+    that CID, so what the cache serves is exactly what the CID names. Once
+    the cache holds more than max_bytes the least recently used files are
+    evicted. Files added with other options than the 'ipfs add' defaults
+    don't hash to their CID here and are simply never cached
+    """
+
+    def __init__(self, cache_dir, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = str(cache_dir)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: OrderedDict = OrderedDict() # cid -> size, least recently used first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+        self.evictions = 0
+        self.rejected = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".tmp"):
+                os.remove(path) # left over from a crash in the middle of an insert
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_atime, name, stat.st_size))
+        # What was used last before the restart is evicted last
+        for _, cid, size in sorted(files):
+            self.entries[cid] = size
+            self.size += size
+        with self.lock:
+            self.evict()
+
+    def path(self, cid):
+        return os.path.join(self.cache_dir, cid)
+
+    def lookup(self, cid):
+        """
+        Path of the cached file, None on a miss
+        """
+        with self.lock:
+            if cid not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(cid)
+            self.hits += 1
+            self.bytes_served += self.entries[cid]
+            return self.path(cid)
+
+    def copy_to(self, cid, destination_path):
+        """
+        Copies the cached file to destination_path, returns False on a miss
+        """
+        path = self.lookup(cid)
+        if path is None:
+            return False
+        output_dir = os.path.dirname(destination_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        try:
+            shutil.copyfile(path, destination_path)
+        except FileNotFoundError:
+            # Evicted between the lookup and the copy
+            return False
+        return True
+
+    def open(self, cid):
+        """
+        (chunks, size) of the cached file like IpfsClient.stream, (None, None) on a miss
+        """
+        path = self.lookup(cid)
+        if path is None:
+            return None, None
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return None, None
+
+        def chunks():
+            with f:
+                while True:
+                    data = f.read(READ_SIZE)
+                    if not data:
+                        break
+                    yield data
+
+        return chunks(), os.fstat(f.fileno()).st_size
+
+    def insert(self, cid, source_path):
+        """
+        Copies a file into the cache if it hashes to cid, returns whether it
+        was cached
+        """
+        if cid in self.entries:
+            return True
+        tmp_path = self.path(f"{uuid.uuid4().hex}.tmp")
+        try:
+            shutil.copyfile(source_path, tmp_path)
+            if file_cid(tmp_path) != cid:
+                os.remove(tmp_path)
+                with self.lock:
+                    self.rejected += 1
+                return False
+        except OSError as e:
+            print(f"Could not cache file {cid}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        return self.commit(cid, tmp_path)
+
+    def tee(self, cid, chunks):
+        """
+        Passes chunks through and writes them to the cache on the way, the
+        file is cached once all of it went through and its CID checked out
+        """
+        tmp_path = self.path(f"{uuid.uuid4().hex}.tmp")
+        builder = CidBuilder()
+        complete = False
+        try:
+            with open(tmp_path, "wb") as f:
+                for data in chunks:
+                    f.write(data)
+                    builder.update(data)
+                    yield data
+            complete = True
+        finally:
+            chunks.close()
+            if complete and builder.cid() == cid:
+                self.commit(cid, tmp_path)
+            else:
+                if complete:
+                    with self.lock:
+                        self.rejected += 1
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def commit(self, cid, tmp_path):
+        size = os.path.getsize(tmp_path)
+        if size > self.max_bytes:
+            os.remove(tmp_path)
+            return False
+        os.replace(tmp_path, self.path(cid))
+        with self.lock:
+            if cid not in self.entries:
+                self.entries[cid] = size
+                self.size += size
+            self.entries.move_to_end(cid)
+            self.evict()
+        return True
+
+    def evict(self):
+        while self.size > self.max_bytes and self.entries:
+            cid, size = self.entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path(cid))
+            except FileNotFoundError:
+                pass
+
+    def metrics(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "files": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes_served": self.bytes_served,
+                "evictions": self.evictions,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,238 @@
+import asyncio, json, os, threading, uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+import requests
+from requests.adapters import HTTPAdapter
+
+API_HOST = "127.0.0.1"
+POOL_SIZE = 8 # keep-alive connections kept open to the daemon
+UPLOAD_WORKERS = POOL_SIZE # files add_many sends at once, one pooled connection each
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 300.0 # adding or fetching a large file can take a while
+CHUNK_SIZE = 1024 * 1024 # files move in pieces of this size, memory use doesn't grow with the file
+
+def print_progress(label, step=10):
+    """
+    Progress callback for add and download that prints every step percent,
+    or every 64 chunks when the size isn't known
+    """
+    last = [-1]
+
+    def report(done, total):
+        if total:
+            mark = done * 100 // total // step
+        else:
+            mark = done // (CHUNK_SIZE * 64)
+        if mark == last[0]:
+            return
+        last[0] = mark
+        if total:
+            print(f"{label}: {done * 100 // total}% ({done}/{total} bytes)")
+        else:
+            print(f"{label}: {done} bytes")
+
+    return report
+
+def multipart_body(f, name, boundary, total, progress=None):
+    """
+    The multipart/form-data body of an add request, generated a chunk at a
+    time so the file is never held in memory as a whole
+    """
+    yield (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{quote(name)}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    done = 0
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        done += len(chunk)
+        if progress:
+            progress(done, total)
+        yield chunk
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+def content_length(response):
+    # cat answers with a chunked body and gives the size in X-Content-Length
+    size = response.headers.get("X-Content-Length") or response.headers.get("Content-Length")
+    try:
+        return int(size) if size is not None else None
+    except ValueError:
+        return None
+
+class IpfsClient:
+    """
+    Talks to an IPFS daemon over its HTTP API (http://host:api_port/api/v0).
+    All requests go through one session, so they reuse pooled keep-alive
+    connections instead of starting an ipfs process per operation
+    """
+
+    def __init__(self, api_port, host=API_HOST):
+        self.base_url = f"http://{host}:{api_port}/api/v0"
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount("http://", adapter)
+
+    def request(self, command, params=None, files=None, data=None, headers=None, stream=False):
+        """
+        Calls one API command, the API only accepts POST. Raises
+        requests.RequestException when the daemon can't be reached or
+        answers with an error
+        """
+        response = self.session.post(
+            f"{self.base_url}/{command}",
+            params=params,
+            files=files,
+            data=data,
+            headers=headers,
+            stream=stream,
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+        )
+        if response.status_code != 200:
+            try:
+                message = response.json().get("Message")
+            except ValueError:
+                message = response.text
+            response.close()
+            raise requests.HTTPError(f"{command} failed with status {response.status_code}: {message}", response=response)
+        return response
+
+    def add(self, file_path, progress=None):
+        """
+        Adds and pins a file, returns (cid, name) or (None, None) on failure.
+        The file is streamed to the daemon in CHUNK_SIZE pieces, progress is
+        called with (bytes sent, file size) after every piece
+        """
+        boundary = uuid.uuid4().hex
+        try:
+            total = os.path.getsize(file_path)
+            with open(file_path, "rb") as f:
+                response = self.request(
+                    "add",
+                    params={"pin": "true"},
+                    data=multipart_body(f, os.path.basename(file_path), boundary, total, progress),
+                    headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}
+                )
+            # One json object per line, the last one is the file we added
+            lines = [line for line in response.text.splitlines() if line.strip()]
+            if not lines:
+                print("Error: No output received from ipfs add.")
+                return None, None
+            added = json.loads(lines[-1])
+            return added["Hash"], added["Name"]
+        except (requests.RequestException, OSError, ValueError, KeyError) as e:
+            print(f"Error adding file to IPFS: {e}")
+            return None, None
+
+    def add_many(self, file_paths, progress=None, workers=UPLOAD_WORKERS):
+        """
+        Adds files workers at a time, returns (cid, name) for every path in
+        the same order with (None, None) for those that failed. progress is
+        called with (bytes sent, size of all files) summed over the files
+        """
+        total = 0
+        for file_path in file_paths:
+            try:
+                total += os.path.getsize(file_path)
+            except OSError:
+                pass
+        sent = [0]
+        lock = threading.Lock()
+
+        def file_progress():
+            # Each file reports its own bytes, they're added to the total
+            last = [0]
+
+            def report(done, _):
+                with lock:
+                    sent[0] += done - last[0]
+                    last[0] = done
+                    progress(sent[0], total)
+
+            return report
+
+        def add_one(file_path):
+            return self.add(file_path, file_progress() if progress else None)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(add_one, file_paths))
+
+    def stream(self, cid):
+        """
+        Opens the file with the given cid, returns (chunks, size) where chunks
+        yields the content in CHUNK_SIZE pieces as it arrives and size may be
+        None. Returns (None, None) when the daemon has no such file
+        """
+        try:
+            response = self.request("cat", params={"arg": cid}, stream=True)
+        except requests.RequestException as e:
+            print(f"Error opening file with CID {cid}: {e}")
+            return None, None
+
+        def chunks():
+            try:
+                yield from response.iter_content(CHUNK_SIZE)
+            finally:
+                response.close()
+
+        return chunks(), content_length(response)
+
+    def download(self, cid, destination_path, progress=None):
+        """
+        Writes the file with the given cid to destination_path, returns
+        whether it worked. The content goes to a .part file first, so a
+        broken transfer never leaves a truncated file under the real name
+        """
+        output_dir = os.path.dirname(destination_path)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+            print(f"Created directory: {output_dir}")
+
+        chunks, total = self.stream(cid)
+        if chunks is None:
+            print("Please check if your IPFS daemon is running and if the CID is valid.")
+            return False
+
+        part_path = destination_path + ".part"
+        done = 0
+        try:
+            with open(part_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    done += len(chunk)
+                    if progress:
+                        progress(done, total)
+            os.replace(part_path, destination_path)
+        except (requests.RequestException, OSError) as e:
+            chunks.close()
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            print(f"Error downloading file with CID {cid}: {e}")
+            return False
+
+        print(f"Successfully downloaded CID {cid} to: {destination_path}")
+        return True
+
+    def is_ready(self):
+        try:
+            self.request("id").close()
+            return True
+        except requests.RequestException:
+            return False
+
+    async def add_async(self, file_path, progress=None):
+        return await asyncio.to_thread(self.add, file_path, progress)
+
+    async def add_many_async(self, file_paths, progress=None, workers=UPLOAD_WORKERS):
+        return await asyncio.to_thread(self.add_many, file_paths, progress, workers)
+
+    async def stream_async(self, cid):
+        return await asyncio.to_thread(self.stream, cid)
+
+    async def download_async(self, cid, destination_path, progress=None):
+        return await asyncio.to_thread(self.download, cid, destination_path, progress)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,69 @@
+import hashlib, json
+from bisect import bisect_left
+
+# Blocks commit to a Merkle root over their files instead of hashing and
+# shipping the whole {cid: desc} list. Nodes read both kinds either way
+FILE_BATCHING = True
+
+def file_leaf(cid, desc):
+    # Leaves and inner nodes are hashed with different prefixes, so an inner
+    # node can't be passed off as a file
+    return hashlib.sha256(b"\x00" + json.dumps([cid, desc]).encode()).digest()
+
+def parent(left, right):
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+def merkle_levels(leaves):
+    """
+    Every level of the tree from the leaves up to the root. The odd node out
+    of a level moves up unchanged instead of being paired with itself
+    """
+    levels = [leaves]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        above = [parent(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            above.append(level[-1])
+        levels.append(above)
+    return levels
+
+def sorted_leaves(files):
+    cids = sorted(files)
+    return cids, [file_leaf(cid, files[cid]) for cid in cids]
+
+def files_root(files):
+    """
+    Hex root over the files ordered by CID, None for no files
+    """
+    if not files:
+        return None
+    _, leaves = sorted_leaves(files)
+    return merkle_levels(leaves)[-1][0].hex()
+
+def files_proof(files, cid):
+    """
+    Inclusion proof of cid as [sibling hash, side] pairs from its leaf up to
+    the root, side says whether the sibling is on the left ("L") or right
+    ("R"). None if cid isn't among the files
+    """
+    if cid not in files:
+        return None
+    cids, leaves = sorted_leaves(files)
+    index = bisect_left(cids, cid)
+    proof = []
+    for level in merkle_levels(leaves)[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append([level[sibling].hex(), "L" if sibling < index else "R"])
+        index //= 2
+    return proof
+
+def verify_file_proof(cid, desc, proof, root):
+    node = file_leaf(cid, desc)
+    try:
+        for sibling, side in proof:
+            sibling = bytes.fromhex(sibling)
+            node = parent(sibling, node) if side == "L" else parent(node, sibling)
+    except (TypeError, ValueError):
+        return False
+    return node.hex() == root
@@ -0,0 +1,165 @@
+"""
+Contract execution benchmark and gas calibration.
+
+    python -m blockchain.smart_contract.benchmark [--repeat N] [--output report.json]
+
+Runs a set of representative contracts in process, through the warm sandbox
+pool and on freshly spawned workers, and prints a JSON report with the
+overhead breakdown (spawn, compile, load, run, IPC) and how much gas a
+millisecond of CPU buys, so changes to the executor or to GAS_LIMIT can be
+compared between runs.
+"""
+import argparse
+import json
+import platform
+import statistics
+import time
+from blockchain.smart_contract.gas_meter import GAS_LIMIT, GAS_ENGINE
+from blockchain.smart_contract.smart_contract import ContractEnvironment, compile_contract
+from blockchain.smart_contract.contracts_db import contract_code_hash
+from blockchain.smart_contract.secure_executor import SandboxWorker, SecureContractExecutor, POOL_SIZE
+
+BASE_DEPLOY_COST = 5 # same as in the peers, deploy gas = len(code)//10 + BASE_DEPLOY_COST
+
+# name -> (code, function, args), every call stays below GAS_LIMIT
+CONTRACTS = {
+    "loop": ("""
+def run(n, state):
+    total = 0
+    for i in range(n):
+        total = total + i * i
+    state['total'] = total
+    return state, 'ok'
+""", "run", [2000]),
+
+    "dict_state": ("""
+def run(n, state):
+    for i in range(n):
+        key = 'k' + str(i)
+        state[key] = state.get(key, 0) + i
+    return state, 'ok'
+""", "run", [1000]),
+
+    "math": ("""
+def run(n, state):
+    acc = 0.0
+    for i in range(1, n):
+        acc = acc + sqrt(i) * log(i) + sin(i)
+    state['acc'] = acc
+    return state, 'ok'
+""", "run", [1500]),
+
+    "recursion": ("""
+def run(n, state):
+    def fib(k):
+        if k < 2:
+            return k
+        return fib(k - 1) + fib(k - 2)
+    state['fib'] = fib(n)
+    return state, 'ok'
+""", "run", [15]),
+
+    "comprehension": ("""
+def run(n, state):
+    squares = [i * i for i in range(n) if i % 3]
+    state['count'] = len(squares)
+    state['sum'] = sum(squares)
+    return state, 'ok'
+""", "run", [3000]),
+}
+
+def measure(fn, repeat):
+    """
+    Median wall time of fn in milliseconds and its last result
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), result
+
+def bench_in_process(code, func_name, args, repeat):
+    compile_ms, compiled = measure(lambda: compile_contract(code), repeat)
+    load_ms, env = measure(lambda: ContractEnvironment(code, compiled), repeat)
+    run_ms, (_, _, gas_used) = measure(lambda: env.run_contract(func_name, args, {}), repeat)
+    return {"compile_ms": compile_ms, "load_ms": load_ms, "run_ms": run_ms, "gas": gas_used}
+
+def bench_warm(code, func_name, args, repeat):
+    executor = SecureContractExecutor(code)
+    # Every pooled worker loads the contract once before we time anything
+    for _ in range(POOL_SIZE * 2):
+        executor.run(func_name, args, {})
+    warm_ms, response = measure(lambda: executor.run(func_name, args, {}), repeat)
+    if not response["success"]:
+        raise Exception(f"Benchmark contract failed: {response['error']}")
+    return warm_ms
+
+def bench_cold(code, func_name, args, repeat):
+    """
+    A fresh worker per call, what every call paid before the pool existed.
+    Returns the spawn time and the time of the first call on the new worker
+    """
+    spawn_times = []
+    call_times = []
+    code_hash = contract_code_hash(code)
+    for _ in range(repeat):
+        start = time.perf_counter()
+        worker = SandboxWorker()
+        spawned = time.perf_counter()
+        worker.run(code_hash, code, None, func_name, args, {})
+        done = time.perf_counter()
+        worker.stop()
+        spawn_times.append((spawned - start) * 1000)
+        call_times.append((done - spawned) * 1000)
+    return statistics.median(spawn_times), statistics.median(call_times)
+
+def run_benchmarks(repeat=20, cold_repeat=5):
+    contracts = {}
+    for name, (code, func_name, args) in CONTRACTS.items():
+        result = bench_in_process(code, func_name, args, repeat)
+        result["warm_ms"] = bench_warm(code, func_name, args, repeat)
+        result["spawn_ms"], result["cold_call_ms"] = bench_cold(code, func_name, args, cold_repeat)
+        result["cold_ms"] = result["spawn_ms"] + result["cold_call_ms"]
+        result["ipc_ms"] = max(result["warm_ms"] - result["run_ms"], 0.0)
+        result["gas_per_ms"] = result["gas"] / result["run_ms"] if result["run_ms"] else None
+        result["deploy_gas"] = len(code) // 10 + BASE_DEPLOY_COST
+        contracts[name] = result
+
+    gas_per_ms = statistics.median(r["gas_per_ms"] for r in contracts.values() if r["gas_per_ms"])
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "gas_engine": GAS_ENGINE,
+            "gas_limit": GAS_LIMIT,
+            "pool_size": POOL_SIZE,
+            "repeat": repeat,
+            "cold_repeat": cold_repeat,
+        },
+        "contracts": contracts,
+        "calibration": {
+            "gas_per_ms": gas_per_ms,
+            # CPU time a call can burn before it runs out of gas
+            "gas_limit_ms": GAS_LIMIT / gas_per_ms,
+            "compile_ms_per_deploy_gas": statistics.median(r["compile_ms"] / r["deploy_gas"] for r in contracts.values()),
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Contract execution benchmark and gas calibration")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per measurement")
+    parser.add_argument("--cold-repeat", type=int, default=5, help="freshly spawned workers per contract")
+    parser.add_argument("--output", help="also write the report to this file")
+    options = parser.parse_args()
+
+    report = run_benchmarks(options.repeat, options.cold_repeat)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,37 @@
+import hashlib
+import marshal
+from blockchain.smart_contract.smart_contract import compile_contract
+
+def contract_code_hash(code):
+    return hashlib.sha256(code.encode()).hexdigest()
+
 class SmartContractDatabase:
     def __init__(self):
         self.contracts = {}
+        self.code_hashes = {}
+        # Marshalled RestrictedPython code objects by code hash, contracts
+        # deployed with the same source share one entry
+        self.compiled = {}
     
     def store_contract(self, contract_id, code):
         self.contracts[contract_id] = code
+        self.code_hashes[contract_id] = contract_code_hash(code)
 
     def get_contract(self, contract_id):
-        return self.contracts.get(contract_id)
\ No newline at end of file
+        return self.contracts.get(contract_id)
+
+    def get_compiled(self, contract_id):
+        """
+        Returns the marshalled code object of a contract, compiling it the
+        first time it's asked for. Returns None if the code doesn't compile,
+        the sandbox then compiles it again and reports the error
+        """
+        code_hash = self.code_hashes.get(contract_id)
+        if code_hash is None:
+            return None
+        if code_hash not in self.compiled:
+            try:
+                self.compiled[code_hash] = marshal.dumps(compile_contract(self.contracts[contract_id]))
+            except Exception:
+                self.compiled[code_hash] = None
+        return self.compiled[code_hash]
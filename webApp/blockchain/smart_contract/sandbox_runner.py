@@ -1,8 +1,14 @@
+import marshal
+from collections import OrderedDict
 from blockchain.smart_contract.smart_contract import ContractEnvironment
+from blockchain.smart_contract.state_codec import encode_state, decode_state
 
-def sandbox_contract_runner(code, func_name, args, state, return_dict):
+FUNCTION_TABLE_SIZE = 64 # loaded contracts kept by each pooled worker
+
+def sandbox_contract_runner(code, func_name, args, state, return_dict, env=None):
     try:
-        env = ContractEnvironment(code)
+        if env is None:
+            env = ContractEnvironment(code)
         state, msg, gas_used = env.run_contract(func_name, args, state)
         return_dict['state'] = state
         return_dict['msg'] = msg
@@ -12,4 +18,54 @@ def sandbox_contract_runner(code, func_name, args, state, return_dict):
         return_dict['state'] = None
         return_dict['msg'] = None
         return_dict['gas_used'] = 0
-        return_dict['error'] = str(e)
\ No newline at end of file
+        return_dict['error'] = str(e)
+
+def load_environment(environments, code_hash, code, compiled):
+    """
+    Returns the environment of a contract from the worker's LRU, creating
+    it from the marshalled code object (or the source) on a miss. Only the
+    code object is kept, every call runs it into fresh globals
+    """
+    env = environments.get(code_hash)
+    if env is not None:
+        environments.move_to_end(code_hash)
+        return env
+
+    env = ContractEnvironment(code, marshal.loads(compiled) if compiled is not None else None)
+    environments[code_hash] = env
+    if len(environments) > FUNCTION_TABLE_SIZE:
+        environments.popitem(last=False)
+    return env
+
+def sandbox_worker_loop(conn):
+    """
+    Entry point of a pooled sandbox process, runs one contract call per
+    request received on conn until it gets None or the pipe is closed
+    """
+    environments: OrderedDict = OrderedDict()
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        if request is None:
+            break
+
+        # States travel as their canonical encoding, not as pickled dicts
+        code_hash, code, compiled, func_name, args, state_data = request
+        return_dict = {}
+        try:
+            env = load_environment(environments, code_hash, code, compiled)
+            state = decode_state(state_data)
+        except Exception as e:
+            return_dict = {'state': None, 'msg': None, 'gas_used': 0, 'error': str(e)}
+            conn.send(return_dict)
+            continue
+
+        sandbox_contract_runner(code, func_name, args, state, return_dict, env)
+        if return_dict['error'] is None:
+            try:
+                return_dict['state'] = encode_state(return_dict['state'])
+            except Exception as e:
+                return_dict = {'state': None, 'msg': None, 'gas_used': 0, 'error': str(e)}
+        conn.send(return_dict)
@@ -0,0 +1,30 @@
+import asyncio
+from collections import OrderedDict
+
+def group_calls(calls, key):
+    """
+    Indexes of calls grouped by key, in the order the keys first show up
+    """
+    groups = OrderedDict()
+    for i, call in enumerate(calls):
+        groups.setdefault(key(call), []).append(i)
+    return list(groups.values())
+
+async def run_grouped(calls, key, run):
+    """
+    Returns [await run(call) for call in calls]. Calls with the same key run
+    one after another in their order, groups with different keys run
+    concurrently, as far as the sandbox pool has free workers. A group stops
+    at the first call that returns a falsy result, the calls after it are
+    left as None
+    """
+    results = [None] * len(calls)
+
+    async def run_group(indexes):
+        for i in indexes:
+            results[i] = await run(calls[i])
+            if not results[i]:
+                return
+
+    await asyncio.gather(*(run_group(indexes) for indexes in group_calls(calls, key)))
+    return results
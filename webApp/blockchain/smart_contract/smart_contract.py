@@ -1,7 +1,7 @@
 from RestrictedPython import compile_restricted
 from RestrictedPython.Eval import default_guarded_getiter
 from RestrictedPython.Guards import safe_builtins
-from blockchain.smart_contract.gas_meter import GasMeter
+from blockchain.smart_contract.gas_meter import gas_policy, new_gas_meter
 import math
 
 def _getitem_(obj, index):
@@ -10,12 +10,16 @@ def _getitem_(obj, index):
 def _write_(obj):
     return obj
 
+def compile_contract(code: str):
+    return compile_restricted(code, filename='<contract>', mode='exec', policy=gas_policy())
+
 class ContractEnvironment:
-    def __init__(self, code: str):
+    def __init__(self, code: str, compiled=None):
         self.code = code
+        self.compiled = compiled
 
-        extended_builtins = dict(safe_builtins)
-        extended_builtins.update({
+        self.builtins = dict(safe_builtins)
+        self.builtins.update({
             'set': set,
             'dict': dict,
             'list': list,
@@ -52,25 +56,35 @@ class ContractEnvironment:
             'factorial': math.factorial,
         })
 
+        if self.compiled is None:
+            self.compiled = compile_contract(self.code)
+
+    def _load(self):
+        """
+        Runs the compiled code into fresh globals and locals. A cached
+        environment only keeps the code object, every call loads it again so
+        nothing a call leaves behind (globals, mutable default arguments,
+        objects created at module level) is seen by the next one
+        """
         self.globals = {
-            '__builtins__': extended_builtins,
+            '__builtins__': dict(self.builtins),
             '_getiter_': default_guarded_getiter,
             '_getitem_': _getitem_,
             '_write_': _write_,
         }
         self.locals = {}
-        self._compile()
-
-    def _compile(self):
-        self.compiled = compile_restricted(self.code, filename='<contract>', mode='exec')
+        # Code at module level is metered too while the contract is loaded
+        self.globals.update(new_gas_meter().hooks())
         exec(self.compiled, self.globals, self.locals)
 
     def run_contract(self, func_name: str, args, state):
+        self._load()
         func = self.locals.get(func_name)
         if not func:
             raise Exception(f"Function '{func_name}' not found in contract.")
-        
-        gas_meter = GasMeter()
+
+        gas_meter = new_gas_meter()
+        self.globals.update(gas_meter.hooks())
 
         try:
             gas_meter.start()
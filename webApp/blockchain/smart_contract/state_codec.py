@@ -0,0 +1,43 @@
+import hashlib
+import json
+import math
+
+def canonical_key(key):
+    """
+    Dict keys the way json writes them, so a state that went through a
+    transaction and one that didn't end up with the same keys
+    """
+    if isinstance(key, str):
+        return key
+    if key is None or isinstance(key, (bool, int, float)):
+        return json.dumps(key)
+    raise TypeError(f"Unsupported key type in contract state: {type(key).__name__}")
+
+def canonical_value(value):
+    if isinstance(value, dict):
+        return {canonical_key(key): canonical_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [canonical_value(item) for item in value]
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError("Contract state can't hold NaN or infinite numbers")
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    raise TypeError(f"Unsupported value type in contract state: {type(value).__name__}")
+
+def encode_state(state):
+    """
+    Canonical encoding of a contract state: compact json with sorted keys,
+    floats in their shortest round-trip form and tuples as lists. Every node
+    gets the same bytes for the same state
+    """
+    return json.dumps(canonical_value(state), sort_keys=True, separators=(",", ":"),
+                      ensure_ascii=False, allow_nan=False).encode("utf-8")
+
+def decode_state(data):
+    return json.loads(data)
+
+def encoded_state_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def state_hash(state):
+    return encoded_state_hash(encode_state(state))
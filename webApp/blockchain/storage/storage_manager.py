@@ -1,5 +1,6 @@
 import os
 import json
+import tempfile
 
 BASE_STORAGE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -12,14 +13,32 @@ def get_consensus_dir(consensus):
     return path
 
 
+def write_json_atomic(path, data, indent=4):
+    """
+    Writes data as json to a temp file next to path and renames it over path,
+    so a crash mid-write never leaves a truncated file behind.
+    """
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=".json")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 # == Node ID ===
 
 def save_node_id(node_id, consensus):
     path = os.path.join(get_consensus_dir(consensus), "node_id.json")
-    with open(path, 'w') as f:
-        json.dump({
-            "node_id": node_id
-        }, f, indent=4)
+    write_json_atomic(path, {
+        "node_id": node_id
+    })
 
 
 def load_node_id(consensus):
@@ -35,10 +54,9 @@ def load_node_id(consensus):
 
 def save_key(private_key_pem, consensus):
     path = os.path.join(get_consensus_dir(consensus), "keys.json")
-    with open(path, 'w') as f:
-        json.dump({
-            "private_key_pem": private_key_pem
-        }, f, indent=4)
+    write_json_atomic(path, {
+        "private_key_pem": private_key_pem
+    })
 
 
 def load_key(consensus):
@@ -54,8 +72,7 @@ def load_key(consensus):
 
 def save_chain(chain, consensus):
     path = os.path.join(get_consensus_dir(consensus), "chain.json")
-    with open(path, 'w') as f:
-        json.dump(chain, f, indent=4)
+    write_json_atomic(path, chain)
 
 
 def load_chain(consensus):
@@ -70,8 +87,7 @@ def load_chain(consensus):
 
 def save_peers(peer_list, consensus):
     path = os.path.join(get_consensus_dir(consensus), "peers.json")
-    with open(path, 'w') as f:
-        json.dump(peer_list, f, indent=4)
+    write_json_atomic(path, peer_list)
 
 
 def load_peers(consensus):
@@ -79,4 +95,25 @@ def load_peers(consensus):
     if not os.path.exists(path):
         return None
     with open(path, 'r') as f:
-        return json.load(f)
\ No newline at end of file
+        return json.load(f)
+
+
+# === Snapshot ===
+
+def save_snapshot(snapshot, consensus):
+    path = os.path.join(get_consensus_dir(consensus), "snapshot.json")
+    write_json_atomic(path, snapshot)
+
+
+def load_snapshot(consensus):
+    path = os.path.join(get_consensus_dir(consensus), "snapshot.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+# === Block store ===
+
+def block_store_path(consensus):
+    return os.path.join(get_consensus_dir(consensus), "blocks.dat")
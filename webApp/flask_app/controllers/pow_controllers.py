@@ -2,7 +2,7 @@ from flask import request, jsonify, Response
 import json, asyncio, websockets
 from collections import OrderedDict
 from blockchain.pow import p2p, blockchain_structures
-from blockchain.pow.ipfs import download_ipfs_file_subprocess
+from blockchain.smart_contract.state_diff import invoke_payload
 from ecdsa import VerifyingKey, MalformedPointError, curves
 from ..app import set_consensus
 import sys, traceback, os
@@ -52,8 +52,7 @@ async def start_new_blockchain():
             peer_instance.run_forever()
         )
 
-        peer_instance.init_repo()
-        peer_instance.configure_ports()
+        peer_instance.start_daemon()
 
         return jsonify({"success":True ,"message": f"Peer '{name}' is being started in the background on {host}:{port}"})
     else:
@@ -104,8 +103,7 @@ async def connect_to_blockchain():
         if peer_instance.miner:
             peer_instance.mine_task=asyncio.create_task(peer_instance.mine_blocks())
 
-        peer_instance.init_repo()
-        peer_instance.configure_ports()
+        peer_instance.start_daemon()
         return jsonify({"success":True ,"message": f"Peer '{name}' is being started in the background on {host}:{port}"})
 
     else:
@@ -160,13 +158,16 @@ async def add_transaction():
         if contract_id not in peer_instance.contractsDB.contracts:
             return jsonify({"success":False, "error": "No such contract found"})
         
-        response = peer_instance.run_contract(payload)
+        # The diff goes against the state the call ran on, the contract can
+        # move on while we wait for the sandbox
+        pre_state = peer_instance.get_contract_state(contract_id)
+        response = await peer_instance.run_contract(payload, pre_state)
         if(response["error"] != None):
             return jsonify({"success":False, "error": response["error"]})
         state = response["state"]
         gas_used = response["gas_used"]
         amount = gas_used * GAS_PRICE
-        payload = [contract_id, func_name, args, state, amount]
+        payload = invoke_payload(contract_id, func_name, args, pre_state, state, amount)
 
     else:
         print("\n\n\nHere is the public key")
@@ -230,6 +231,28 @@ def get_contracts():
 
     return jsonify({"success":True, "message":"succesful request", "contracts": contracts})
 
+async def view_contract():
+    global peer_instance
+    if(not request.is_json):
+        return jsonify({"success":False, "error": "Request must be JSON"})
+
+    data=request.get_json()
+    contract_id=data.get('contract_id')
+    func_name=data.get('func_name')
+    args=data.get('args', [])
+
+    if(not (contract_id and func_name)):
+        return jsonify({"success":False, "error": "Contract Id or Function Name Not Found"})
+
+    if contract_id not in peer_instance.contractsDB.contracts:
+        return jsonify({"success":False, "error": "No such contract found"})
+
+    response = await peer_instance.view_contract(contract_id, func_name, args)
+    if(response["error"] != None):
+        return jsonify({"success":False, "error": response["error"]})
+
+    return jsonify({"success":True, "message":"succesful request", "result": response["msg"], "state": response["state"]})
+
 def get_status():
     global peer_instance
     amt=peer_instance.chain.calc_balance(peer_instance.wallet.public_key_pem, list(peer_instance.mem_pool))
@@ -306,7 +329,28 @@ async def uploadFileIPFS():
     #The output of the first method, os.path.join(), would be home/desktop/newFolder/my_story.txt on a Linux or macOS system. On a Windows system, it would automatically be home\desktop\newFolder\my_story.txt, correctly handling the different slash.
     return jsonify({"success":True, "message": "File Uploaded"})
 
-def downloadFileIPFS():
+async def uploadFilesIPFS():
+    global peer_instance
+    if(not request.is_json):
+        return jsonify({"success":False, "error": "Request must be JSON"})
+
+    data=request.get_json()
+    files=data.get('files')
+    path=data.get('path')
+    # Either a list of {"desc", "path"} or a folder that is uploaded as a whole
+    if files:
+        pkt=await peer_instance.uploadFiles([(file.get('desc', ''), file.get('path', '')) for file in files])
+    elif path:
+        pkt=await peer_instance.uploadDirectory(data.get('desc', ''), path)
+    else:
+        return jsonify({"success":False, "error": "Request must have files or path"})
+
+    if not pkt:
+        return jsonify({"success":False, "error": "No File Uploaded"})
+    await peer_instance.broadcast_message(pkt)
+    return jsonify({"success":True, "message": "Files Uploaded", "files": pkt["files"]})
+
+async def downloadFileIPFS():
     global peer_instance
     if(not request.is_json):
         return jsonify({"success":False, "error": "Request must be JSON"})
@@ -317,5 +361,32 @@ def downloadFileIPFS():
     name=data.get('name')
     full_path=os.path.join(path, name)
     print(full_path)
-    download_ipfs_file_subprocess(cid, full_path)
+    if not await peer_instance.downloadFile(cid, full_path):
+        return jsonify({"success":False, "error": "File Download Failed"})
     return jsonify({"success":True, "message": "File Downloaded"})
+
+async def streamFileIPFS(cid):
+    global peer_instance
+    name=request.args.get('name', cid)
+
+    # The body goes from the daemon to the client a chunk at a time, the
+    # file is never written to disk or held in memory here
+    chunks, size=await peer_instance.streamFile(cid)
+    if chunks is None:
+        return jsonify({"success":False, "error": "File Not Found"}), 404
+
+    headers={"Content-Disposition": f'attachment; filename="{os.path.basename(name)}"'}
+    if size is not None:
+        headers["Content-Length"]=str(size)
+    return Response(chunks, mimetype='application/octet-stream', headers=headers)
+
+def file_block(cid):
+    global peer_instance
+    anchor=peer_instance.file_block(cid)
+    if anchor is None:
+        return jsonify({"success":False, "error": "No block anchors this CID"}), 404
+    return jsonify({"success":True, "message":"succesful request", "file": anchor})
+
+def file_cache_metrics():
+    global peer_instance
+    return jsonify({"success":True, "message":"succesful request", "file_cache": peer_instance.file_cache.metrics()})
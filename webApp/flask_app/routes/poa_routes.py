@@ -31,6 +31,10 @@ async def find_balance():
 async def view_contracts():
     return poa_controllers.get_contracts()
 
+@poa_bp.route('/view', methods=['POST'])
+async def view_contract():
+    return await poa_controllers.view_contract()
+
 @poa_bp.route('/states', methods=['GET'])
 async def view_states():
     return poa_controllers.get_states()
@@ -79,6 +83,22 @@ def server_check():
 async def uploadFile():
     return await poa_controllers.uploadFileIPFS()
 
+@poa_bp.route('/uploadFiles', methods=['POST'])
+async def uploadFiles():
+    return await poa_controllers.uploadFilesIPFS()
+
 @poa_bp.route('/downloadFile', methods=['POST'])
-def downloadFile():
-    return poa_controllers.downloadFileIPFS()
\ No newline at end of file
+async def downloadFile():
+    return await poa_controllers.downloadFileIPFS()
+
+@poa_bp.route('/file/<cid>', methods=['GET'])
+async def streamFile(cid):
+    return await poa_controllers.streamFileIPFS(cid)
+
+@poa_bp.route('/file/<cid>/block', methods=['GET'])
+def fileBlock(cid):
+    return poa_controllers.file_block(cid)
+
+@poa_bp.route('/fileCache', methods=['GET'])
+def fileCache():
+    return poa_controllers.file_cache_metrics()
\ No newline at end of file
@@ -31,6 +31,10 @@ async def find_balance():
 async def view_contracts():
     return pos_controllers.get_contracts()
 
+@pos_bp.route('/view', methods=['POST'])
+async def view_contract():
+    return await pos_controllers.view_contract()
+
 @pos_bp.route('/status', methods=['GET'])
 def return_status():
     return pos_controllers.get_status()
@@ -55,9 +59,25 @@ def server_check():
 async def uploadFile():
     return await pos_controllers.uploadFileIPFS()
 
+@pos_bp.route('/uploadFiles', methods=['POST'])
+async def uploadFiles():
+    return await pos_controllers.uploadFilesIPFS()
+
 @pos_bp.route('/downloadFile', methods=['POST'])
-def downloadFile():
-    return pos_controllers.downloadFileIPFS()
+async def downloadFile():
+    return await pos_controllers.downloadFileIPFS()
+
+@pos_bp.route('/file/<cid>', methods=['GET'])
+async def streamFile(cid):
+    return await pos_controllers.streamFileIPFS(cid)
+
+@pos_bp.route('/file/<cid>/block', methods=['GET'])
+def fileBlock(cid):
+    return pos_controllers.file_block(cid)
+
+@pos_bp.route('/fileCache', methods=['GET'])
+def fileCache():
+    return pos_controllers.file_cache_metrics()
 
 @pos_bp.route('/view_stakes', methods=['GET'])
 def view_stakes():
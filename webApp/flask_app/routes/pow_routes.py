@@ -31,6 +31,10 @@ async def find_balance():
 async def view_contracts():
     return pow_controllers.get_contracts()
 
+@pow_bp.route('/view', methods=['POST'])
+async def view_contract():
+    return await pow_controllers.view_contract()
+
 @pow_bp.route('/status', methods=['GET'])
 def return_status():
     return pow_controllers.get_status()
@@ -55,6 +59,22 @@ def server_check():
 async def uploadFile():
     return await pow_controllers.uploadFileIPFS()
 
+@pow_bp.route('/uploadFiles', methods=['POST'])
+async def uploadFiles():
+    return await pow_controllers.uploadFilesIPFS()
+
 @pow_bp.route('/downloadFile', methods=['POST'])
-def downloadFile():
-    return pow_controllers.downloadFileIPFS()
\ No newline at end of file
+async def downloadFile():
+    return await pow_controllers.downloadFileIPFS()
+
+@pow_bp.route('/file/<cid>', methods=['GET'])
+async def streamFile(cid):
+    return await pow_controllers.streamFileIPFS(cid)
+
+@pow_bp.route('/file/<cid>/block', methods=['GET'])
+def fileBlock(cid):
+    return pow_controllers.file_block(cid)
+
+@pow_bp.route('/fileCache', methods=['GET'])
+def fileCache():
+    return pow_controllers.file_cache_metrics()
\ No newline at end of file